@@ -0,0 +1,75 @@
+import itertools
+
+import numpy as np
+from sqlalchemy import Float, Integer, select
+
+from db.models import STREAM_CHUNK_SIZE, Function
+
+# Server-side cursors of a connection need distinct names
+cursor_ids = itertools.count()
+
+
+def select_functions(columns, **filters):
+    """
+    Return Core select of 'columns' (names of Function columns) of
+    functions whose columns equal values given in 'filters' (None matches
+    NULL).
+    """
+    table = Function.__table__
+    statement = select(*(table.c[column] for column in columns))
+
+    for column, value in filters.items():
+        statement = statement.where(table.c[column] == value)
+
+    return statement
+
+
+def iter_functions(session, columns, chunk_size=STREAM_CHUNK_SIZE, **filters):
+    """
+    Yield plain tuples of 'columns' of functions matching 'filters' (see
+    select_functions). Rows bypass ORM, no objects are built or tracked,
+    and are fetched 'chunk_size' at a time through server-side cursor, so
+    session must not be committed until iteration ends.
+    """
+    compiled = select_functions(columns, **filters).compile(
+        dialect=session.get_bind().dialect
+    )
+    connection = session.connection().connection
+    cursor = connection.cursor(name=f"functions_{next(cursor_ids)}")
+    cursor.itersize = chunk_size
+
+    try:
+        cursor.execute(str(compiled), compiled.params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def column_array(column, values):
+    """
+    Return NumPy array of 'values' of Function 'column'. Numbers are
+    float64 with NaN for NULL (int64 if there are none), others objects.
+    """
+    column_type = Function.__table__.c[column].type
+
+    if isinstance(column_type, Integer) and None not in values:
+        return np.array(values, dtype=np.int64)
+
+    if isinstance(column_type, (Integer, Float)):
+        return np.array(values, dtype=np.float64)
+
+    return np.array(values, dtype=object)
+
+
+def function_arrays(session, columns, chunk_size=STREAM_CHUNK_SIZE, **filters):
+    """
+    Return dict of NumPy arrays of 'columns' of functions matching
+    'filters', by column name (see iter_functions and column_array).
+    """
+    rows = iter_functions(session, columns, chunk_size, **filters)
+    values = list(zip(*rows)) or [()] * len(columns)
+
+    return {
+        column: column_array(column, list(column_values))
+        for column, column_values in zip(columns, values)
+    }
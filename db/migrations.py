@@ -0,0 +1,114 @@
+from rich.console import Console
+from sqlalchemy import text
+
+console = Console()
+
+# Applied versions are recorded in this table
+MIGRATIONS_TABLE = "schema_migrations"
+# Key of advisory lock held while migrating, so concurrent runs apply each
+# migration once
+MIGRATION_LOCK_ID = 20240601
+
+# List of (version, name, statements). Tables are created by create_all
+# with all current columns before migrations run, so statements must be
+# idempotent: they bring databases created by older revisions up to date and
+# are no-ops on new ones. Column added to an existing table needs its own
+# migration, appended with the next version.
+MIGRATIONS = [
+    (
+        1,
+        "repository metadata columns",
+        [
+            "ALTER TABLE repos ADD COLUMN IF NOT EXISTS default_branch VARCHAR",
+            "ALTER TABLE repos ADD COLUMN IF NOT EXISTS pushed_at TIMESTAMP",
+        ],
+    ),
+    (
+        2,
+        "repository first commit date",
+        ["ALTER TABLE repos ADD COLUMN IF NOT EXISTS first_commit_at TIMESTAMP"],
+    ),
+    (
+        3,
+        "files of functions",
+        [
+            "ALTER TABLE functions ADD COLUMN IF NOT EXISTS file_id INTEGER "
+            "REFERENCES files (id)",
+        ],
+    ),
+    (
+        4,
+        "skipped files",
+        ["ALTER TABLE files ADD COLUMN IF NOT EXISTS skipped VARCHAR"],
+    ),
+    (
+        5,
+        "function indexes",
+        [
+            # Function.filter_by/stream_by, iter_functions and
+            # Repo.get_without_functions filter or join on repo_id
+            "CREATE INDEX IF NOT EXISTS ix_functions_repo_id ON functions (repo_id)",
+            # delete_file_functions and retire_files delete by file_id
+            "CREATE INDEX IF NOT EXISTS ix_functions_file_id ON functions (file_id)",
+            # update_function_grammar updates all functions with given name
+            "CREATE INDEX IF NOT EXISTS ix_functions_name ON functions (name)",
+            # Function.get_metrics_with_labels filters on lang and domain
+            "CREATE INDEX IF NOT EXISTS ix_functions_lang_domain "
+            "ON functions (lang, domain)",
+            # get_distinct_function_names_without_grammar
+            "CREATE INDEX IF NOT EXISTS ix_functions_name_without_grammar "
+            "ON functions (name) "
+            "WHERE selected AND (grammar IS NULL OR grammar = '')",
+            # Word concreteness only reads functions of a repository which
+            # do not have it yet, the index shrinks as the metric fills up.
+            # Other calculators read all functions of a repository.
+            "CREATE INDEX IF NOT EXISTS "
+            "ix_functions_repo_id_without_median_word_concreteness "
+            "ON functions (repo_id) WHERE median_word_concreteness IS NULL",
+            "ANALYZE functions",
+        ],
+    ),
+]
+
+
+def applied_versions(connection):
+    rows = connection.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))
+    return {row[0] for row in rows}
+
+
+def migrate(engine):
+    """
+    Apply pending MIGRATIONS in order, each in its own transaction, and
+    record their versions. Indexes are built with plain CREATE INDEX, which
+    blocks writes to the table while it runs, so migrate between runs.
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ("
+                "version INTEGER PRIMARY KEY, name VARCHAR, "
+                "applied_at TIMESTAMP DEFAULT now())"
+            )
+        )
+
+    for version, name, statements in MIGRATIONS:
+        with engine.begin() as connection:
+            connection.execute(
+                text("SELECT pg_advisory_xact_lock(:id)"), dict(id=MIGRATION_LOCK_ID)
+            )
+
+            if version in applied_versions(connection):
+                continue
+
+            console.print(f"Applying migration {version}: {name}")
+
+            for statement in statements:
+                connection.execute(text(statement))
+
+            connection.execute(
+                text(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (version, name) "
+                    "VALUES (:version, :name)"
+                ),
+                dict(version=version, name=name),
+            )
@@ -1,12 +1,22 @@
 import random
 from collections import defaultdict
 
-from sqlalchemy import (Boolean, Column, Float, ForeignKey, Integer, String,
-                        func)
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Integer,
+                        String, func)
 from sqlalchemy.orm import relationship
 
 from db.engine import Base
 
+# Rows fetched per round trip by server-side cursors of stream_* queries
+STREAM_CHUNK_SIZE = 1000
+
+
+def stream(query, chunk_size=STREAM_CHUNK_SIZE):
+    # Iterate 'query' through server-side cursor, 'chunk_size' rows at a
+    # time, instead of loading all rows at once. Session must not be
+    # committed until iteration ends, commit closes the cursor.
+    return query.yield_per(chunk_size)
+
 
 class ARTRun(Base):
     __tablename__ = "art_runs"
@@ -88,6 +98,9 @@ class Repo(Base):
     readme = Column(String, nullable=True, default=None)
     comment = Column(String, nullable=True, default=None)
     about = Column(String, nullable=True, default=None)
+    default_branch = Column(String, nullable=True, default=None)
+    pushed_at = Column(DateTime, nullable=True, default=None)
+    first_commit_at = Column(DateTime, nullable=True, default=None)
 
     @staticmethod
     def all(session, **kwargs):
@@ -115,6 +128,38 @@ class Repo(Base):
         )
 
 
+# Source file from which functions were extracted, used to skip unchanged
+# files when extracting again. 'hash' is git blob id of file's contents.
+# 'skipped' is reason why file was not parsed (see scripts/extract/prefilter.py).
+class File(Base):
+    __tablename__ = "files"
+
+    id = Column(Integer, primary_key=True)
+    repo_id = Column(Integer, ForeignKey("repos.id"), index=True)
+    path = Column(String)
+    size = Column(Integer, nullable=True)
+    mtime = Column(Float, nullable=True)
+    hash = Column(String)
+    functions = Column(Integer, default=0)
+    skipped = Column(String, nullable=True)
+
+
+# Source file whose extraction failed: it timed out, pushed worker's memory
+# over its ceiling or raised an error. Later runs skip it until the row is
+# deleted.
+class QuarantinedFile(Base):
+    __tablename__ = "quarantined_files"
+
+    id = Column(Integer, primary_key=True)
+    repo_id = Column(Integer, ForeignKey("repos.id"), index=True)
+    path = Column(String)
+    hash = Column(String, nullable=True)
+    reason = Column(String)
+    detail = Column(String, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+# Indexes of functions are created by migrations (see db/migrations.py).
 class Function(Base):
     __tablename__ = "functions"
 
@@ -122,6 +167,7 @@ class Function(Base):
     name = Column(String)
     names = Column(String)
     repo_id = Column(Integer, ForeignKey("repos.id"))
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=True)
     file_name = Column(String)
     lang = Column(String)
     order = Column(Integer)
@@ -157,6 +203,15 @@ class Function(Base):
             .all()
         )
 
+    @staticmethod
+    def stream_all_names(session, chunk_size=STREAM_CHUNK_SIZE):
+        query = (
+            session.query(Function.names)
+            .filter(Function.domain.isnot(None))
+            .filter(Function.domain != "")
+        )
+        return stream(query, chunk_size)
+
     @staticmethod
     def filter_by(session, **kwargs):
         query = session.query(Function)
@@ -165,6 +220,14 @@ class Function(Base):
                 query = query.filter(getattr(Function, key) == value)
         return query.all()
 
+    @staticmethod
+    def stream_by(session, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+        query = session.query(Function)
+        for key, value in kwargs.items():
+            if hasattr(Function, key):
+                query = query.filter(getattr(Function, key) == value)
+        return stream(query, chunk_size)
+
     @staticmethod
     def get_metrics(session, limit, metric):
         query = session.query(Function)
@@ -173,6 +236,14 @@ class Function(Base):
         query = query.with_entities(getattr(Function, metric))
         return query.all()
 
+    @staticmethod
+    def stream_metrics(session, limit, metric, chunk_size=STREAM_CHUNK_SIZE):
+        query = session.query(Function)
+        query = query.filter(getattr(Function, metric).isnot(None))
+        query = query.limit(limit)
+        query = query.with_entities(getattr(Function, metric))
+        return stream(query, chunk_size)
+
     @staticmethod
     def get_metrics_with_labels(session, langs, limit, metric, domains):
         results = []
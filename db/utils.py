@@ -1,17 +1,38 @@
+import io
 import json
+import time
 from collections import defaultdict
 import casestyle
 import random
 
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, aliased
 from sqlalchemy import func, asc
 
 from db.engine import engine, Base
-from db.models import Repo, Function
+from db.migrations import migrate
+from db.models import File, Function, QuarantinedFile, Repo, stream
 
 session = None
 
+# Number of rows inserted by single INSERT statement
+INSERT_BATCH_SIZE = 1000
+# Number of functions buffered by FunctionLoader before they are copied
+COPY_BATCH_SIZE = 5000
+FUNCTION_COPY_COLUMNS = [
+    "name",
+    "names",
+    "repo_id",
+    "file_id",
+    "file_name",
+    "lang",
+    "order",
+    "selected",
+]
+# Number of functions buffered by MetricWriter before their metrics are written
+METRIC_BATCH_SIZE = 5000
+
 
 def commit():
     session.commit()
@@ -20,6 +41,7 @@ def commit():
 def init_session():
     global session
     Base.metadata.create_all(engine)
+    migrate(engine)
     Session = sessionmaker(bind=engine)
     session = Session()
 
@@ -28,19 +50,41 @@ def init_local_session():
     return sessionmaker(bind=engine)()
 
 
+def release_inherited_connections():
+    """
+    Drop connections pooled by parent process, call after fork so child
+    process does not share them.
+    """
+    engine.dispose(close=False)
+
+
 def get_repo(repo_id):
     return session.query(Repo).filter_by(id=repo_id).first()
 
 
-def add_repo(id, name, stars, size, lang, owner):
-    new_repo = Repo(id=id, name=name, stars=stars, size=size, lang=lang, owner=owner)
+def add_repos(repos):
+    """
+    Insert or update repositories given as dicts with 'id', 'name', 'stars',
+    'size', 'lang' and 'owner' keys, in batches of INSERT_BATCH_SIZE rows.
+    Existing repositories get their 'name', 'owner', 'stars' and 'size'
+    refreshed, other columns are left untouched, so re-running is safe.
+    """
+    # Postgres rejects statement which updates the same row twice
+    repos = list({repo["id"]: repo for repo in repos}.values())
 
-    try:
-        session.add(new_repo)
-        session.commit()
-    except IntegrityError:
-        print(f"IntegrityError for {id}, {owner}/{name}, skipping")
-        session.rollback()
+    for start in range(0, len(repos), INSERT_BATCH_SIZE):
+        statement = insert(Repo).values(repos[start : start + INSERT_BATCH_SIZE])
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[Repo.id],
+                set_={
+                    column: statement.excluded[column]
+                    for column in ["name", "owner", "stars", "size"]
+                },
+            )
+        )
+
+    session.commit()
 
 
 def get_repos():
@@ -53,10 +97,30 @@ def update_repo(repo, path, readme):  # , files, loc, readme):
     session.commit()
 
 
+def update_repo_metadata(repo, default_branch, size, stars, pushed_at):
+    repo.default_branch = default_branch
+    repo.size = size
+    repo.stars = stars
+    repo.pushed_at = pushed_at
+
+
+def update_repo_first_commit(repo, first_commit_at):
+    repo.first_commit_at = first_commit_at
+
+
 def get_functions_for_repo(repo_id, session):
     return session.query(Function).filter_by(repo_id=repo_id).all()
 
 
+def stream_functions_for_repo(repo_id, session):
+    """
+    Like get_functions_for_repo, but functions are fetched in chunks from
+    server-side cursor as they are iterated (see db.models.stream).
+    """
+    query = session.query(Function).filter_by(repo_id=repo_id)
+    return stream(query)
+
+
 def get_distinct_function_names_without_grammar():
     names_by_lang = (
         session.query(Function.name)
@@ -74,11 +138,12 @@ def update_function_grammar(session, name, new_grammar):
     )
 
 
-def add_function(session, name, names, repo_id, file_name, lang, order):
+def add_function(session, name, names, repo_id, file_name, lang, order, file_id=None):
     new_fn = Function(
         name=name,
         names=names,
         repo_id=repo_id,
+        file_id=file_id,
         file_name=file_name,
         lang=lang,
         order=order,
@@ -89,4 +154,261 @@ def add_function(session, name, names, repo_id, file_name, lang, order):
         session.commit()
     except IntegrityError:
         print(f"IntegrityError")
-        session.rollback()
\ No newline at end of file
+        session.rollback()
+
+
+def copy_value(value):
+    """
+    Format 'value' as field of COPY text format.
+    """
+    if value is None:
+        return "\\N"
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class FunctionLoader:
+    """
+    Buffers extracted functions and writes them with PostgreSQL COPY in
+    batches of 'batch_size' rows, instead of a transaction per function.
+    Stat of completed files (see complete_file) is written in the same
+    transaction as their last functions. Until then files are indexed
+    without new stat, so if worker crashes they are extracted again on the
+    next run and their already copied functions are deleted first.
+    """
+
+    def __init__(self, session, batch_size=COPY_BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+        self.rows = []
+        self.files = []
+        self.written = 0
+
+    def add(self, name, names, repo_id, file_name, lang, order, file_id=None):
+        self.rows.append(
+            (name, names, repo_id, file_id, file_name, lang, order, False)
+        )
+
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def complete_file(self, file, size, mtime, hash, functions, skipped=None):
+        self.files.append((file, size, mtime, hash, functions, skipped))
+
+    def discard(self, file):
+        """
+        Drop buffered functions and stat of 'file'.
+        """
+        self.rows = [row for row in self.rows if row[3] != file.id]
+        self.files = [stat for stat in self.files if stat[0] is not file]
+
+    def flush(self):
+        if self.rows:
+            buffer = io.StringIO()
+
+            for row in self.rows:
+                buffer.write("\t".join(map(copy_value, row)) + "\n")
+
+            buffer.seek(0)
+            columns = ", ".join(f'"{column}"' for column in FUNCTION_COPY_COLUMNS)
+            cursor = self.session.connection().connection.cursor()
+            cursor.copy_expert(f"COPY functions ({columns}) FROM STDIN", buffer)
+
+        for file, *stat in self.files:
+            update_file(self.session, file, *stat, commit=False)
+
+        self.session.commit()
+        self.written += len(self.rows)
+        self.rows, self.files = [], []
+
+
+def group_metrics(metrics):
+    """
+    Group dict of {metric: value} dicts by function id into {metric names:
+    rows of (function id, *values)}, so each group updates the same columns.
+    """
+    groups = defaultdict(list)
+
+    for function_id, values in metrics.items():
+        columns = tuple(sorted(values))
+        groups[columns].append((function_id, *(values[c] for c in columns)))
+
+    return groups
+
+
+class MetricWriter:
+    """
+    Buffers computed metrics of functions and writes them in batches of
+    'batch_size' functions, instead of a transaction per function. Each
+    batch is copied into a temporary table and applied with one UPDATE ...
+    FROM per set of metrics. 'written' counts functions updated so far and
+    'rate' functions updated per second spent writing. Writer commits on its
+    own session unless given one, so functions loaded by caller are not
+    expired (and reloaded one by one) after each batch.
+    """
+
+    def __init__(self, session=None, batch_size=METRIC_BATCH_SIZE):
+        self.own_session = session is None
+        self.session = init_local_session() if session is None else session
+        self.batch_size = batch_size
+        self.metrics = {}
+        self.written = 0
+        self.elapsed = 0
+
+    def add(self, function_id, metrics):
+        """
+        Set 'metrics', dict of {column: value}, of function 'function_id'.
+        """
+        for column in metrics:
+            if column not in Function.__table__.columns:
+                raise ValueError(f"Unknown metric {column}")
+
+        self.metrics.setdefault(function_id, {}).update(metrics)
+
+        if len(self.metrics) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        start = time.perf_counter()
+        cursor = self.session.connection().connection.cursor()
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS function_metrics (LIKE functions)"
+        )
+
+        for columns, rows in group_metrics(self.metrics).items():
+            buffer = io.StringIO()
+
+            for row in rows:
+                buffer.write("\t".join(map(copy_value, row)) + "\n")
+
+            buffer.seek(0)
+            names = ", ".join(f'"{column}"' for column in columns)
+            cursor.copy_expert(
+                f"COPY function_metrics (id, {names}) FROM STDIN", buffer
+            )
+            assignments = ", ".join(f'"{c}" = m."{c}"' for c in columns)
+            cursor.execute(
+                f"UPDATE functions AS f SET {assignments} "
+                "FROM function_metrics AS m WHERE f.id = m.id"
+            )
+            cursor.execute("TRUNCATE function_metrics")
+
+        self.session.commit()
+        self.written += len(self.metrics)
+        self.metrics = {}
+        self.elapsed += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+
+        if self.own_session:
+            self.session.close()
+
+    @property
+    def rate(self):
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+
+def get_file_index(session, repo_id):
+    """
+    Return dict of indexed files of repository by their path.
+    """
+    files = session.query(File).filter_by(repo_id=repo_id).all()
+    return {file.path: file for file in files}
+
+
+def get_file(session, repo_id, path):
+    return session.query(File).filter_by(repo_id=repo_id, path=path).first()
+
+
+def add_file(session, repo_id, path, size, mtime, hash, commit=True):
+    new_file = File(repo_id=repo_id, path=path, size=size, mtime=mtime, hash=hash)
+    session.add(new_file)
+
+    if commit:
+        session.commit()
+    else:
+        session.flush()  # Assigns id
+
+    return new_file
+
+
+def update_file(
+    session, file, size, mtime, hash, functions=None, skipped=None, commit=True
+):
+    """
+    Update stat of indexed 'file'. Once file has been processed again,
+    'functions' gives number of extracted functions and 'skipped' reason why
+    it was not parsed, if so.
+    """
+    file.size = size
+    file.mtime = mtime
+    file.hash = hash
+
+    if functions is not None:
+        file.functions = functions
+        file.skipped = skipped
+
+    if commit:
+        session.commit()
+
+
+def delete_file_functions(session, file, commit=True):
+    session.query(Function).filter_by(file_id=file.id).delete()
+    file.functions = 0
+
+    if commit:
+        session.commit()
+
+
+def retire_files(session, files):
+    """
+    Delete indexed 'files' which no longer exist, with their functions.
+    """
+    ids = [file.id for file in files]
+
+    if ids:
+        session.query(Function).filter(Function.file_id.in_(ids)).delete()
+        session.query(File).filter(File.id.in_(ids)).delete()
+        session.commit()
+
+
+def storable_path(path):
+    """
+    Return 'path' as text PostgreSQL accepts. Names which are not valid
+    UTF-8 are decoded by os.fsdecode into lone surrogates, their bytes are
+    escaped instead.
+    """
+    return path.encode("utf-8", "surrogateescape").decode("utf-8", "backslashreplace")
+
+
+def get_quarantined_hashes(session, repo_id):
+    files = (
+        session.query(QuarantinedFile.path, QuarantinedFile.hash)
+        .filter_by(repo_id=repo_id)
+        .all()
+    )
+    return {file.path: file.hash for file in files}
+
+
+def quarantine_file(session, repo_id, path, hash, reason, detail=None):
+    # Only the latest contents of a file stay quarantined
+    session.query(QuarantinedFile).filter_by(
+        repo_id=repo_id, path=storable_path(path)
+    ).delete()
+    session.add(
+        QuarantinedFile(
+            repo_id=repo_id,
+            path=storable_path(path),
+            hash=hash,
+            reason=reason,
+            detail=detail,
+        )
+    )
+    session.commit()
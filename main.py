@@ -7,9 +7,10 @@ from rich.console import Console
 from scipy.spatial.distance import cosine
 
 from db.models import Repo
-from db.utils import init_local_session, init_session
+from db.utils import get_repos, init_local_session, init_session
 from scripts.statistics import Statistics
-from scripts.download import clone_repos, download_repos
+from scripts.download import (clone_repos, download_first_commit_dates,
+                              download_repos, download_repos_metadata)
 from scripts.extract.functions import Functions
 from scripts.extract.grammar import Grammar
 from scripts.lang import LANGS
@@ -71,7 +72,26 @@ def word_similarity(a: str, b: str, model: str):
 
 
 @app.command()
-def extract_functions(lang=None):
+def extract_functions(
+    lang=None,
+    source: str = "files",
+    engine: str = "walk",
+    incremental: bool = False,
+    sample: bool = False,
+):
+    """
+    Extract functions from cloned repositories. Source 'files' reads checked
+    out files, 'tracked' reads checked out files listed by 'git ls-files',
+    'git' reads blobs straight from repository's object store (works with
+    bare clones) and 'archive' streams files from tar or zip archives
+    without unpacking them (repository's path points to archive).
+    Engine 'walk' visits every node of syntax trees from Python, 'query'
+    matches function definitions and identifiers with compiled tree-sitter
+    queries. With --incremental all cloned repositories are processed, but
+    only files which are new or changed since the previous run are parsed.
+    With --sample functions of repositories are first estimated without
+    parsing and only a uniform sample of files up to the cap is parsed.
+    """
     langs = None
 
     if lang != None:
@@ -80,7 +100,7 @@ def extract_functions(lang=None):
         langs = LANGS
 
     init_session()
-    Functions.extract(langs)
+    Functions.extract(langs, source, engine, incremental, sample)
 
 
 @app.command()
@@ -92,13 +112,13 @@ def extract_grammar():
 @app.command()
 def download_repo_info(num_projects: int, lang: str = None):
     """
-    Download repository information. Populates 'repos' table. Table must be
-    empty for a given language before running this command to avoid integrity
-    error. Command expects GITHUB_TOKEN env variable to contain valid Github's
-    personal access token.  As of 09/24, current rate limit for repository
-    search endpoint for authorized users is 30 requests per minute. In case of
-    403's check if rate limit changed and adjust GITHUB_REQUEST_DELAY which
-    specifies time in seconds to wait between requests (defaults to 2). Example:
+    Download repository information. Populates 'repos' table, repositories
+    which are already present get their name, owner, stars and size
+    refreshed, so the command can be re-run safely. Command expects
+    GITHUB_TOKEN env variable to contain valid Github's personal access
+    token. Result pages are downloaded concurrently and paced by rate limit
+    headers returned by Github (X-RateLimit-Remaining, X-RateLimit-Reset and
+    Retry-After), so no manual delay is needed. Example:
 
         python main.py download-repo-info 100 --lang=elixir
     """
@@ -115,12 +135,55 @@ def download_repo_info(num_projects: int, lang: str = None):
 
 
 @app.command()
-def clone(force: bool = False, only_missing: bool = False):
+def download_repo_metadata(lang: str = None):
+    """
+    Download default branch, size, stars and last push date of repositories
+    in 'repos' table using batched GraphQL queries (100 repositories per
+    query). Metadata of repositories without it is also downloaded before
+    cloning.
+    """
+    init_session()
+    repos = get_repos()
+
+    if lang != None:
+        repos = repos.filter(Repo.lang == lang)
+
+    download_repos_metadata(repos.all())
+
+
+@app.command()
+def download_first_commit_date(lang: str = None):
+    """
+    Find dates of first commits of repositories in 'repos' table. Takes at
+    most two API requests per repository, falling back to local clone when
+    API fails (shallow clones fetch their commit history first). Dates are
+    stored in 'first_commit_at' column and are not downloaded again.
+    """
+    init_session()
+    repos = get_repos()
+
+    if lang != None:
+        repos = repos.filter(Repo.lang == lang)
+
+    download_first_commit_dates(repos.all())
+
+
+@app.command()
+def clone(
+    force: bool = False,
+    only_missing: bool = False,
+    workers: int = 8,
+    bare: bool = False,
+):
     """
-    Clone repositories from Github.
+    Clone repositories from Github. Repositories are cloned in parallel by
+    'workers' threads, each making blobless partial clone with sparse checkout
+    of files in repository's language. With --bare, repositories are cloned
+    without working tree, use 'extract-functions --source=git' to extract
+    functions from them.
     """
     init_session()
-    clone_repos(DATA_DIR, force, only_missing)
+    clone_repos(DATA_DIR, force, only_missing, workers=workers, bare=bare)
 
 
 @app.command()
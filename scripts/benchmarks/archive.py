@@ -0,0 +1,142 @@
+# Compares throughput of extracting functions from files streamed straight
+# from tar.gz/zip archives with unpacking the archives to disk first.
+# To run:
+# > python -m scripts.benchmarks.archive -i data/python/owner_repo -l python
+
+import argparse
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from rich.console import Console
+from rich.table import Table
+from tree_sitter import Language, Parser
+
+from scripts.extract.sources import archive_files, disk_files
+from scripts.parsing import parsers
+
+console = Console()
+
+
+def make_archives(repo_path, out_dir):
+    """
+    Pack all files of 'repo_path' (except .git) into tar.gz and zip archives.
+    """
+    tar_path = os.path.join(out_dir, "repo.tar.gz")
+    zip_path = os.path.join(out_dir, "repo.zip")
+
+    with tarfile.open(tar_path, "w:gz") as tar, zipfile.ZipFile(
+        zip_path, "w", zipfile.ZIP_DEFLATED
+    ) as zip_file:
+        for dirpath, dirnames, filenames in os.walk(repo_path):
+            dirnames[:] = [d for d in dirnames if d != ".git"]
+
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, repo_path)
+                tar.add(path, name)
+                zip_file.write(path, name)
+
+    return [tar_path, zip_path]
+
+
+def unpack(archive_path, out_dir):
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(out_dir)
+    else:
+        with tarfile.open(archive_path) as archive:
+            # Extraction filters are not available in older Python releases
+            if hasattr(tarfile, "data_filter"):
+                archive.extractall(out_dir, filter="data")
+            else:
+                archive.extractall(out_dir)
+
+
+def consume(files, parser, extract_fn):
+    """
+    Load and (unless 'parser' is None) parse all files. Returns number of
+    files, bytes and functions.
+    """
+    num_files, num_bytes, num_functions = 0, 0, 0
+
+    for file in files:
+        content = file.load()
+        num_files += 1
+        num_bytes += len(content)
+
+        if parser is not None:
+            num_functions += len(parsers.extract_content(parser, content, extract_fn))
+
+    return num_files, num_bytes, num_functions
+
+
+def benchmark(archive_path, lang, parser, extract_fn, rounds):
+    results = {}
+
+    for mode in ["unpack + files", "archive"]:
+        best = None
+
+        for _ in range(rounds):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                start = time.perf_counter()
+
+                if mode == "archive":
+                    files = archive_files(archive_path, lang)
+                else:
+                    unpack(archive_path, tmp_dir)
+                    files = disk_files(tmp_dir, lang)
+
+                counts = consume(files, parser, extract_fn)
+                elapsed = time.perf_counter() - start
+
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[mode] = (counts, best)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="repository directory", required=True)
+    parser.add_argument("-l", "--lang", help="language", required=True)
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    parser.add_argument(
+        "--no-parse", action="store_true", help="only read files, skip parsing"
+    )
+    args = parser.parse_args()
+
+    ts_parser = None
+    extract_fn = getattr(parsers, f"extract_{args.lang}")
+
+    if not args.no_parse:
+        ts_parser = Parser()
+        ts_parser.set_language(Language("build/parser_bindings.so", args.lang))
+
+    table = Table("archive", "mode", "files", "MB", "functions", "seconds", "MB/s")
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+        for archive_path in make_archives(args.input, tmp_dir):
+            results = benchmark(
+                archive_path, args.lang, ts_parser, extract_fn, args.rounds
+            )
+
+            for mode, ((files, size, functions), elapsed) in results.items():
+                table.add_row(
+                    os.path.basename(archive_path),
+                    mode,
+                    str(files),
+                    f"{size / 2**20:.1f}",
+                    str(functions),
+                    f"{elapsed:.3f}",
+                    f"{size / 2**20 / elapsed:.1f}",
+                )
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    console.print(table)
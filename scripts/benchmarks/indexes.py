@@ -0,0 +1,197 @@
+# Records EXPLAIN ANALYZE execution times of hot queries on the functions
+# table before and after migrations (see db/migrations.py) add its indexes.
+# Tables are created in a scratch schema, filled with generated repositories
+# and functions (contiguous per repository, as extraction writes them, with
+# a few percent of metrics and grammars still missing) and dropped
+# afterwards. Queries mirror Repo.get_without_functions,
+# Function.get_metrics_with_labels, update_function_grammar,
+# get_distinct_function_names_without_grammar, delete_file_functions and
+# iter_functions; statements which modify rows are rolled back. With local
+# PostgreSQL, 1M functions: per-name grammar updates 61 -> 0.12 ms, per-file
+# deletes 64 -> 0.02 ms, per-repository reads 71 -> 0.14 ms, functions still
+# missing concreteness 113 -> 0.02 ms, Repo.get_without_functions 165 -> 26 ms.
+# To run:
+# > python -m scripts.benchmarks.indexes --functions 1000000
+# > python -m scripts.benchmarks.indexes --database-url postgresql://user@host/db
+
+import argparse
+import json
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import create_engine, text
+
+import db.engine
+import db.models
+from db.migrations import migrate
+from scripts.lang import LANGS
+
+SCHEMA = "index_benchmark"
+DOMAINS = ["web", "systems", "science", "tools", "games"]
+# Repository whose functions are read by per-repository queries
+REPO_ID = 500
+
+QUERIES = [
+    (
+        "Repo.get_without_functions",
+        "SELECT repos.id FROM repos "
+        "LEFT OUTER JOIN functions ON repos.id = functions.repo_id "
+        "WHERE repos.lang = 'c' GROUP BY repos.id "
+        "HAVING count(functions.id) BETWEEN 0 AND 10",
+    ),
+    (
+        "Function.get_metrics_with_labels",
+        "SELECT term_entropy, lang, domain FROM functions "
+        "WHERE term_entropy IS NOT NULL AND domain IN ('tools', 'web') "
+        "AND lang = 'ocaml' LIMIT 4000",
+    ),
+    (
+        "update_function_grammar",
+        "UPDATE functions SET grammar = 'VP' WHERE name = 'function_1234'",
+    ),
+    (
+        "get_distinct_function_names_without_grammar",
+        "SELECT DISTINCT name FROM functions "
+        "WHERE selected AND (grammar IS NULL OR grammar = '')",
+    ),
+    (
+        "delete_file_functions",
+        "DELETE FROM functions WHERE file_id = 1234",
+    ),
+    (
+        "iter_functions (repository)",
+        f"SELECT id, names FROM functions WHERE repo_id = {REPO_ID}",
+    ),
+    (
+        "iter_functions (without concreteness)",
+        f"SELECT id, names FROM functions WHERE repo_id = {REPO_ID} "
+        "AND median_word_concreteness IS NULL",
+    ),
+]
+
+console = Console()
+
+
+def populate(engine, num_repos, num_functions):
+    per_repo = num_functions // num_repos
+    langs = "ARRAY[" + ", ".join(f"'{lang}'" for lang in LANGS) + "]"
+    domains = "ARRAY[" + ", ".join(f"'{domain}'" for domain in DOMAINS) + "]"
+
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO repos (id, name, stars, size, lang, owner, selected) "
+                f"SELECT i, 'repo' || i, i, i, ({langs})[1 + i % {len(LANGS)}], "
+                "'owner', i % 2 = 0 FROM generate_series(1, :repos) i"
+            ),
+            dict(repos=num_repos),
+        )
+        connection.execute(
+            text(
+                "INSERT INTO files (id, repo_id, path, hash, functions) "
+                f"SELECT i, 1 + (i - 1) * 20 / {per_repo}, 'file' || i, '', 20 "
+                "FROM generate_series(1, :files) i"
+            ),
+            dict(files=num_functions // 20),
+        )
+        connection.execute(
+            text(
+                "INSERT INTO functions (name, names, repo_id, file_id, file_name, "
+                'lang, "order", domain, selected, grammar, term_entropy, '
+                "median_word_concreteness) "
+                "SELECT 'function_' || i % 200000, 'a b c', r, 1 + (i - 1) / 20, "
+                f"'file', ({langs})[1 + r % {len(LANGS)}], i, "
+                "CASE WHEN r % 10 < 3 THEN NULL "
+                f"ELSE ({domains})[1 + r % {len(DOMAINS)}] END, "
+                "i % 2 = 0, CASE WHEN i % 20 = 0 THEN NULL ELSE 'VP' END, "
+                "CASE WHEN i % 10 = 0 THEN NULL ELSE random() END, "
+                "CASE WHEN i % 20 = 0 THEN NULL ELSE random() END "
+                f"FROM (SELECT i, 1 + (i - 1) / {per_repo} AS r "
+                "FROM generate_series(1, :functions) i) AS s"
+            ),
+            dict(functions=num_functions),
+        )
+        connection.execute(text("ANALYZE"))
+
+
+def scans(plan):
+    """
+    Return indexes used by scans of 'plan' (node of EXPLAIN JSON output)
+    and its children, or "Seq Scan".
+    """
+    names = []
+
+    if "Index Name" in plan:
+        names.append(plan["Index Name"])
+    elif plan["Node Type"] == "Seq Scan":
+        names.append("Seq Scan")
+
+    for child in plan.get("Plans", []):
+        names.extend(scans(child))
+
+    return names
+
+
+def explain(engine, query, rounds):
+    """
+    Return (best execution time in ms, scans) of 'query' over 'rounds'.
+    """
+    best, plan = None, None
+
+    for _ in range(rounds):
+        with engine.connect() as connection:
+            result = connection.execute(
+                text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+            ).scalar()
+            connection.rollback()
+
+        result = result if isinstance(result, list) else json.loads(result)
+        elapsed = result[0]["Execution Time"]
+
+        if best is None or elapsed < best:
+            best, plan = elapsed, result[0]["Plan"]
+
+    return best, ", ".join(dict.fromkeys(scans(plan)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--functions", type=int, default=1000000)
+    parser.add_argument("--repos", type=int, default=1000)
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    parser.add_argument("--database-url", help="defaults to db/engine.py settings")
+    args = parser.parse_args()
+
+    url = args.database_url or db.engine.engine.url
+    admin = create_engine(url)
+    engine = create_engine(url, connect_args=dict(options=f"-c search_path={SCHEMA}"))
+
+    with admin.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+
+    try:
+        db.models.Base.metadata.create_all(engine)
+        populate(engine, args.repos, args.functions)
+        before = [explain(engine, query, args.rounds) for _, query in QUERIES]
+        migrate(engine)
+        after = [explain(engine, query, args.rounds) for _, query in QUERIES]
+    finally:
+        engine.dispose()
+
+        with admin.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+    table = Table("query", "before (ms)", "after (ms)", "speedup", "scans after")
+
+    for (name, _), (before_ms, _), (after_ms, plan) in zip(QUERIES, before, after):
+        table.add_row(
+            name,
+            f"{before_ms:.2f}",
+            f"{after_ms:.2f}",
+            f"{before_ms / after_ms:.1f}",
+            plan,
+        )
+
+    console.print(f"{args.functions} functions in {args.repos} repositories")
+    console.print(table)
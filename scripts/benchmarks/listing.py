@@ -0,0 +1,91 @@
+# Compares time to enumerate source files of a checked out repository: full
+# os.walk filtering paths afterwards (earlier revision of
+# scripts/extract/sources.py), single-pass walk pruning ignored directories,
+# and 'git ls-files'. Files are only listed and stat'ed, not read. 'not
+# listed' counts files found by the baseline only (in pruned directories or
+# untracked). The baseline is required: pass a revision whose disk_files
+# still walks all directories, e.g. the merge-base of your branch with main.
+# To run:
+# > python -m scripts.benchmarks.listing --baseline $(git merge-base HEAD main) \
+#   -i data/c/torvalds_linux -l c
+# > python -m scripts.benchmarks.listing --baseline main \
+#   -i data/c/torvalds_linux -l c --cold
+
+import argparse
+import os
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+from scripts.benchmarks.walkers import load_baseline
+from scripts.extract import sources
+
+console = Console()
+
+
+def drop_caches():
+    """
+    Drop page, dentry and inode caches, so directories are read from disk.
+    Requires root.
+    """
+    os.sync()
+
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def measure(list_files, repo_path, lang, rounds, cold):
+    """
+    Return (set of listed paths, best time in seconds).
+    """
+    best = None
+
+    for _ in range(rounds):
+        if cold:
+            drop_caches()
+
+        start = time.perf_counter()
+        paths = {file.path for file in list_files(repo_path, lang)}
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return paths, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="repository directory", required=True)
+    parser.add_argument("-l", "--lang", help="language of files", default="c")
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    parser.add_argument("--cold", action="store_true", help="drop caches first")
+    parser.add_argument(
+        "--baseline", required=True, help="git revision walking all directories"
+    )
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline, "scripts/extract/sources.py")
+    listings = [
+        (f"os.walk ({args.baseline})", baseline.disk_files),
+        ("pruned walk", sources.disk_files),
+        ("git ls-files", sources.tracked_files),
+    ]
+    table = Table("listing", "files", "not listed", "seconds", "files/s", "speedup")
+    expected, baseline_time = None, None
+
+    for name, list_files in listings:
+        paths, elapsed = measure(
+            list_files, args.input, args.lang, args.rounds, args.cold
+        )
+        expected = expected if expected is not None else paths
+        baseline_time = baseline_time or elapsed
+        table.add_row(
+            name,
+            str(len(paths)),
+            str(len(expected - paths)),
+            f"{elapsed:.3f}",
+            f"{len(paths) / elapsed:,.0f}",
+            f"{baseline_time / elapsed:.1f}",
+        )
+
+    console.print(table)
@@ -0,0 +1,176 @@
+# Measures how extraction time grows with file size on synthetic files of
+# 1k-100k lines, for current extractors and those of an earlier revision of
+# scripts/parsing/parsers.py. Time per line should stay flat as files grow.
+# The baseline is required: pass a revision whose C extractor still searches
+# children recursively, e.g. the merge-base of your branch with main.
+# To run:
+# > python -m scripts.benchmarks.scaling --baseline $(git merge-base HEAD main) \
+#   -l c --shape nested
+# > python -m scripts.benchmarks.scaling --baseline main -l ocaml --sizes 1000 10000
+
+import argparse
+import time
+from collections import defaultdict
+from functools import partial
+
+from rich.console import Console
+from rich.table import Table
+from tree_sitter import Language, Parser
+
+from scripts.benchmarks.walkers import load_baseline
+from scripts.parsing import parsers
+
+SIZES = [1000, 3000, 10000, 30000, 100000]
+
+console = Console()
+
+
+def c_function(i, header):
+    return [
+        f"{header} {{",
+        f"    int x{i} = compute(a, {i});",
+        f"    if (x{i} > limit) {{",
+        f"        x{i} = clamp(x{i}, limit);",
+        "    }",
+        f"    return x{i} + b;",
+    ]
+
+
+def generate_c(num_lines, shape):
+    """
+    Return C source of about 'num_lines' lines. Shape 'flat' is a sequence
+    of ordinary functions, 'macro' uses macro calls as function headers (no
+    function declarator), 'nested' nests such definitions in each other.
+    """
+    lines = []
+    depth = 0
+
+    for i in range(num_lines // 7):
+        if shape == "flat":
+            lines += c_function(i, f"int function_{i}(int a, int b)") + ["}"]
+        elif shape == "macro":
+            lines += c_function(i, f"DEFINE_HANDLER(handler_{i})") + ["}"]
+        else:
+            lines += c_function(i, f"DEFINE_HANDLER(handler_{i})")[:-1]
+            depth += 1
+
+    return "\n".join(lines + ["}"] * depth) + "\n"
+
+
+def generate_fortran(num_lines, shape):
+    lines = []
+
+    for i in range(num_lines // 7):
+        lines += [
+            f"subroutine routine_{i}(a, b, c)",
+            "  integer :: a, b, c",
+            f"  c = a * {i} + b",
+            "  if (c > a) then",
+            "    c = a",
+            "  end if",
+            f"end subroutine routine_{i}",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def generate_ocaml(num_lines, shape):
+    lines = []
+
+    for i in range(num_lines // 7):
+        lines += [
+            f"let function_{i} a b =",
+            f"  let x = a * {i} + b in",
+            "  if x > a then",
+            "    a",
+            "  else",
+            "    x",
+            "",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def run_baseline(baseline, extract_fn, tree):
+    acc = defaultdict(list)
+    baseline.walk(tree.root_node, acc, baseline.unique_id(), extract_fn)
+    return acc
+
+
+def run_current(extract_fn, tree):
+    return parsers.merge(parsers.iter_functions(tree.root_node, extract_fn))
+
+
+def measure(run, tree, rounds):
+    """
+    Return (result, best time in seconds), or (None, error) on failure.
+    """
+    best = None
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+
+        try:
+            result = run(tree)
+        except RecursionError as e:
+            return None, e
+
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return result, best
+
+
+def format_time(elapsed, num_lines):
+    if isinstance(elapsed, Exception):
+        return type(elapsed).__name__, ""
+
+    return f"{elapsed:.3f}", f"{elapsed / num_lines * 1e6:.1f}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--lang", choices=["c", "fortran", "ocaml"], default="c")
+    parser.add_argument("--shape", choices=["flat", "macro", "nested"], default="flat")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    parser.add_argument(
+        "--baseline", required=True, help="git revision to compare against"
+    )
+    args = parser.parse_args()
+
+    ts_parser = Parser()
+    ts_parser.set_language(Language("build/parser_bindings.so", args.lang))
+    baseline = load_baseline(args.baseline)
+    generate = globals()[f"generate_{args.lang}"]
+    table = Table(
+        "lines",
+        "functions",
+        f"{args.baseline} s",
+        f"{args.baseline} µs/line",
+        "current s",
+        "current µs/line",
+        "same output",
+    )
+
+    for num_lines in args.sizes:
+        source = generate(num_lines, args.shape)
+        num_lines = source.count("\n")
+        tree = ts_parser.parse(source.encode())
+        baseline_fn = getattr(baseline, f"extract_{args.lang}")
+        current_fn = getattr(parsers, f"extract_{args.lang}")
+        expected, baseline_time = measure(
+            partial(run_baseline, baseline, baseline_fn), tree, args.rounds
+        )
+        result, current_time = measure(
+            partial(run_current, current_fn), tree, args.rounds
+        )
+        table.add_row(
+            str(num_lines),
+            str(len(result)),
+            *format_time(baseline_time, num_lines),
+            *format_time(current_time, num_lines),
+            "" if expected is None else str(expected == result),
+        )
+
+    console.print(table)
@@ -0,0 +1,191 @@
+# Compares throughput (AST nodes per second) of recursive extractors from an
+# earlier revision of scripts/parsing/parsers.py with the current iterative
+# TreeCursor walker and compiled Query engine, and checks that all produce the
+# same functions. The baseline is required: pass a revision whose extractors
+# are still recursive, e.g. the merge-base of your branch with main.
+# To run:
+# > python -m scripts.benchmarks.walkers --baseline $(git merge-base HEAD main)
+# > python -m scripts.benchmarks.walkers --baseline main -i data/c/owner_repo \
+#   -l c --depth 5000
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import types
+from collections import defaultdict
+
+from rich.console import Console
+from rich.table import Table
+from tree_sitter import Language, Parser
+
+from scripts.extract.sources import disk_files
+from scripts.lang import LANGS, is_ext_valid
+from scripts.parsing import parsers
+
+SAMPLES_DIR = "tests/samples"
+
+console = Console()
+
+
+def load_baseline(rev, path="scripts/parsing/parsers.py"):
+    """
+    Import module at 'path' as of git revision 'rev'.
+    """
+    source = subprocess.run(
+        ["git", "show", f"{rev}:{path}"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    package = os.path.dirname(path).replace("/", ".")
+    module = types.ModuleType(f"{package}.baseline")
+    module.__package__ = package
+    exec(compile(source, f"{rev}:{path}", "exec"), module.__dict__)
+    return module
+
+
+def get_inputs(input_path, lang):
+    """
+    Return list of (lang, content) tuples. Without 'input_path' all samples
+    from tests/samples are used, each with its language.
+    """
+    if input_path is None:
+        return [
+            (sample_lang, parsers.load_file(os.path.join(SAMPLES_DIR, file)))
+            for file in sorted(os.listdir(SAMPLES_DIR))
+            for sample_lang in LANGS
+            if is_ext_valid(sample_lang, file)
+        ]
+
+    if os.path.isfile(input_path):
+        return [(lang, parsers.load_file(input_path))]
+
+    return [(lang, file.load()) for file in disk_files(input_path, lang)]
+
+
+def nested_source(lang, depth):
+    """
+    Return function whose body is an expression nested 'depth' levels deep.
+    """
+    if lang == "c":
+        return b"int f(int x) { return " + b"(" * depth + b"x" + b")" * depth + b"; }"
+
+    return b"def f(x):\n    return " + b"[" * depth + b"x" + b"]" * depth + b"\n"
+
+
+def run_baseline(baseline, tree, lang):
+    acc = defaultdict(list)
+    getattr(baseline, f"extract_{lang}")(tree.root_node, acc, baseline.unique_id())
+    return acc
+
+
+def run_cursor(tree, lang):
+    extract_fn = getattr(parsers, f"extract_{lang}")
+    return parsers.merge(parsers.iter_functions(tree.root_node, extract_fn))
+
+
+def run_query(tree, lang):
+    extract_fn = getattr(parsers, f"query_{lang}")
+    return parsers.merge(parsers.iter_functions(tree.root_node, extract_fn))
+
+
+def benchmark(run, trees, rounds):
+    """
+    Return (results, best time in seconds) of extracting functions from all
+    'trees', or (None, error) if extraction failed.
+    """
+    best = None
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+
+        try:
+            results = [run(tree, lang) for lang, tree in trees]
+        except RecursionError as e:
+            return None, e
+
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return results, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="file or repository directory")
+    parser.add_argument("-l", "--lang", help="language of input", default="python")
+    parser.add_argument("-r", "--rounds", type=int, default=5)
+    parser.add_argument(
+        "--baseline", required=True, help="git revision with recursive extractors"
+    )
+    parser.add_argument(
+        "--depth", type=int, default=0, help="add input nested this deep"
+    )
+    args = parser.parse_args()
+
+    inputs = get_inputs(args.input, args.lang)
+
+    if args.depth:
+        inputs.append((args.lang, nested_source(args.lang, args.depth)))
+
+    trees = []
+
+    for lang, content in inputs:
+        ts_parser = Parser()
+
+        try:
+            ts_parser.set_language(Language("build/parser_bindings.so", lang))
+        except AttributeError:
+            console.print(f"No grammar for {lang}, skipping", style="yellow")
+            continue
+
+        trees.append((lang, ts_parser.parse(content)))
+
+    baseline = load_baseline(args.baseline)
+    num_nodes = sum(tree.root_node.descendant_count for _, tree in trees)
+    console.print(
+        f"{len(trees)} inputs, {num_nodes} nodes, "
+        f"recursion limit {sys.getrecursionlimit()}"
+    )
+
+    baseline_results, baseline_time = benchmark(
+        lambda tree, lang: run_baseline(baseline, tree, lang), trees, args.rounds
+    )
+    engines = dict(
+        cursor=benchmark(run_cursor, trees, args.rounds),
+        query=benchmark(run_query, trees, args.rounds),
+    )
+
+    table = Table("walker", "seconds", "nodes/s", "speedup")
+
+    if baseline_results is None:
+        table.add_row(f"recursive ({args.baseline})", type(baseline_time).__name__)
+    else:
+        table.add_row(
+            f"recursive ({args.baseline})",
+            f"{baseline_time:.4f}",
+            f"{num_nodes / baseline_time:,.0f}",
+            "1.00",
+        )
+
+    for engine, (results, elapsed) in engines.items():
+        table.add_row(
+            engine,
+            f"{elapsed:.4f}",
+            f"{num_nodes / elapsed:,.0f}",
+            f"{baseline_time / elapsed:.2f}" if baseline_results else "",
+        )
+
+    console.print(table)
+
+    if baseline_results is not None:
+        for engine, (results, _) in engines.items():
+            mismatches = [
+                lang
+                for (lang, _), expected, actual in zip(trees, baseline_results, results)
+                if expected != actual
+            ]
+            console.print(
+                f"Inputs with different functions ({engine}): {len(mismatches)}"
+            )
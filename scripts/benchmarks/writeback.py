@@ -0,0 +1,113 @@
+# Compares throughput (functions per second) of writing computed metrics by
+# setting attributes of loaded functions and committing each one (as metric
+# calculators did) with MetricWriter batches. Rows are written for a scratch
+# repository, which is removed afterwards. Each commit expires all loaded
+# functions, so the baseline slows down with more rows. With local
+# PostgreSQL over Unix socket, 2k rows: commit per function ~110 functions/s,
+# MetricWriter ~34,000 functions/s.
+# To run:
+# > python -m scripts.benchmarks.writeback --rows 2000
+# > python -m scripts.benchmarks.writeback --database-url postgresql://user@host/db
+
+import argparse
+import random
+import time
+
+from rich.console import Console
+from rich.table import Table
+from sqlalchemy import create_engine
+
+import db.utils
+from db.models import File, Function, Repo
+
+# Id of scratch repository, real Github ids are positive
+REPO_ID = -1
+METRICS = ["median_id_length", "id_duplicate_percentage", "term_entropy"]
+
+console = Console()
+
+
+def make_functions(session, num_rows):
+    loader = db.utils.FunctionLoader(session)
+
+    for order in range(1, num_rows + 1):
+        loader.add(f"function_{order}", "a b c", REPO_ID, "file.py", "python", order)
+
+    loader.flush()
+
+
+def compute_metrics(function):
+    return {metric: random.random() for metric in METRICS}
+
+
+def write_commit_per_function(session, batch_size):
+    for function in Function.filter_by(session, repo_id=REPO_ID):
+        for key, value in compute_metrics(function).items():
+            setattr(function, key, value)
+
+        session.commit()
+
+
+def write_metric_writer(session, batch_size):
+    writer = db.utils.MetricWriter(batch_size=batch_size)
+
+    for function in Function.filter_by(session, repo_id=REPO_ID):
+        writer.add(function.id, compute_metrics(function))
+
+    writer.close()
+
+
+def clean(session):
+    session.query(Function).filter_by(repo_id=REPO_ID).delete()
+    session.query(File).filter_by(repo_id=REPO_ID).delete()
+    session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=db.utils.METRIC_BATCH_SIZE)
+    parser.add_argument("--database-url", help="defaults to db/engine.py settings")
+    args = parser.parse_args()
+
+    if args.database_url:
+        db.utils.engine = create_engine(args.database_url)
+
+    db.utils.init_session()
+    session = db.utils.session
+    db.utils.add_repos(
+        [dict(id=REPO_ID, name="benchmark", stars=0, size=0, lang="python", owner="")]
+    )
+    table = Table("writer", "functions", "seconds", "functions/s", "speedup")
+    baseline = None
+
+    try:
+        for writer, write in [
+            ("commit per function", write_commit_per_function),
+            ("MetricWriter", write_metric_writer),
+        ]:
+            clean(session)
+            make_functions(session, args.rows)
+            start = time.perf_counter()
+            write(session, args.batch_size)
+            elapsed = time.perf_counter() - start
+            written = (
+                session.query(Function)
+                .filter_by(repo_id=REPO_ID)
+                .filter(Function.term_entropy.isnot(None))
+                .count()
+            )
+            baseline = baseline or elapsed
+            table.add_row(
+                writer,
+                str(written),
+                f"{elapsed:.2f}",
+                f"{written / elapsed:,.0f}",
+                f"{baseline / elapsed:.1f}",
+            )
+    finally:
+        clean(session)
+        session.query(Repo).filter_by(id=REPO_ID).delete()
+        session.commit()
+
+    console.print(table)
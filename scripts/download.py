@@ -1,28 +1,66 @@
+import asyncio
 import math
 import os
 import shutil
 import subprocess
 import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
-import requests
+import httpx
 from rich.console import Console
 
 from db.models import Repo
-from db.utils import add_repo, get_repos, update_repo
-from scripts.lang import LANG_TO_EXT
+from db.utils import (
+    add_repos,
+    commit,
+    get_repos,
+    update_repo,
+    update_repo_first_commit,
+    update_repo_metadata,
+)
+from scripts.github import GithubClient, ResponseCache
+from scripts.extract.sources import list_git_blobs
+from scripts.lang import LANG_TO_EXT, is_ext_valid
+
+CLONE_URL = "https://github.com/{owner}/{name}.git"
+CLONE_WORKERS = 8
+METADATA_BATCH_SIZE = 100
+# Dates returned by Github API are in UTC
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Fail instead of prompting for credentials when repository is not available
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+README_FILES = [
+    "README.md",
+    "readme.md",
+    "README.txt",
+    "readme.txt",
+    "README.rst",
+    "readme.rst",
+    "readme",
+    "README",
+]
+
+RepoMetadata = namedtuple(
+    "RepoMetadata", ["default_branch", "size", "stars", "pushed_at"]
+)
+CloneTask = namedtuple(
+    "CloneTask", ["repo_id", "url", "path", "lang", "branch", "bare"], defaults=[False]
+)
+CloneResult = namedtuple(
+    "CloneResult", ["repo_id", "path", "readme", "fetched", "error"]
+)
 
 console = Console()
 
 
-def get_top_repos_by_language(language, num, page):
+async def get_top_repos_by_language(client, language, num, page):
     """
     Download info on top 'num' GitHub repositories on specified page for
     specified language.
     """
-    token = os.getenv("GITHUB_TOKEN", None)
-
-    # Define the URL and parameters for the request
-    url = "https://api.github.com/search/repositories"
     params = {
         "q": f"language:{language}",
         "sort": "stars",
@@ -31,10 +69,7 @@ def get_top_repos_by_language(language, num, page):
         "page": page,
     }
 
-    # Set the Authorization header with Bearer token
-    headers = {"Authorization": f"Bearer {token}"}
-
-    response = requests.get(url, params=params, headers=headers)
+    response = await client.get("/search/repositories", params=params)
 
     if response.status_code == 200:
         return response.json()["items"]
@@ -43,200 +78,454 @@ def get_top_repos_by_language(language, num, page):
         return []
 
 
-def clone_repos(dest_dir, force=False, only_missing=False, verbose=False):
+def build_metadata_query(repos):
+    """
+    Build GraphQL query looking up metadata of all 'repos' at once. Each
+    repository is queried under alias 'r<index>'.
+    """
+    params = ", ".join(f"$o{i}: String!, $n{i}: String!" for i in range(len(repos)))
+    fields = "defaultBranchRef { name } diskUsage stargazerCount pushedAt"
+    aliases = " ".join(
+        f"r{i}: repository(owner: $o{i}, name: $n{i}) {{ {fields} }}"
+        for i in range(len(repos))
+    )
+    variables = {}
+
+    for i, repo in enumerate(repos):
+        variables[f"o{i}"] = repo.owner
+        variables[f"n{i}"] = repo.name
+
+    return {"query": f"query({params}) {{ {aliases} }}", "variables": variables}
+
+
+def parse_metadata(node):
+    pushed_at = node.get("pushedAt")
+
+    if pushed_at:
+        pushed_at = datetime.strptime(pushed_at, GITHUB_DATE_FORMAT)
+
+    return RepoMetadata(
+        (node.get("defaultBranchRef") or {}).get("name"),
+        node.get("diskUsage"),
+        node.get("stargazerCount"),
+        pushed_at,
+    )
+
+
+async def get_repos_metadata(client, repos):
+    """
+    Look up metadata of up to METADATA_BATCH_SIZE 'repos' with a single
+    GraphQL query. Returns dictionary mapping repo id to RepoMetadata,
+    repositories which could not be resolved are omitted.
+    """
+    response = await client.post("/graphql", json=build_metadata_query(repos))
+
+    if response.status_code != 200:
+        console.print("Failed to retrieve metadata:", response.status_code)
+        return {}
+
+    data = response.json().get("data") or {}
+    metadata = {}
+
+    for i, repo in enumerate(repos):
+        node = data.get(f"r{i}")
+
+        if node:
+            metadata[repo.id] = parse_metadata(node)
+        else:
+            console.print(f"Failed to get metadata for {repo.owner}/{repo.name}")
+
+    return metadata
+
+
+async def get_all_repos_metadata(repos):
+    """
+    Look up metadata of all 'repos' in batches of METADATA_BATCH_SIZE.
+    """
+    batches = [
+        repos[i : i + METADATA_BATCH_SIZE]
+        for i in range(0, len(repos), METADATA_BATCH_SIZE)
+    ]
+
+    async with GithubClient(cache=ResponseCache.from_env()) as client:
+        results = await asyncio.gather(
+            *[get_repos_metadata(client, batch) for batch in batches]
+        )
+
+    return {repo_id: meta for result in results for repo_id, meta in result.items()}
+
+
+def download_repos_metadata(repos):
+    """
+    Fill in 'default_branch', 'size', 'stars' and 'pushed_at' columns of
+    'repos'.
+    """
+    metadata = asyncio.run(get_all_repos_metadata(repos))
+
+    for repo in repos:
+        if repo.id in metadata:
+            update_repo_metadata(repo, *metadata[repo.id])
+
+    commit()
+    console.print(f"Downloaded metadata of {len(metadata)}/{len(repos)} repositories")
+
+
+def get_sparse_patterns(lang):
+    """
+    Return sparse checkout patterns matching source files of 'lang' and
+    README files.
+    """
+    return [f"*{ext}" for ext in LANG_TO_EXT[lang]] + README_FILES
+
+
+def get_fetched_bytes(repo_path):
+    """
+    Return size in bytes of objects downloaded into 'repo_path'.
+    """
+    output = subprocess.run(
+        ["git", "-C", repo_path, "count-objects", "-v"],
+        capture_output=True,
+        text=True,
+    ).stdout
+    stats = dict(line.split(": ") for line in output.splitlines())
+    return (int(stats.get("size", 0)) + int(stats.get("size-pack", 0))) * 1024
+
+
+def read_readme(repo_path, bare=False):
+    """
+    Return first 25 lines of repository's README file. README of bare
+    repository is read from its HEAD commit.
+    """
+    content = None
+
+    for readme_file in README_FILES:
+        if bare:
+            result = subprocess.run(
+                ["git", "-C", repo_path, "show", f"HEAD:{readme_file}"],
+                capture_output=True,
+            )
+            if result.returncode == 0:
+                content = result.stdout
+                break
+        else:
+            readme_path = os.path.join(repo_path, readme_file)
+            if os.path.exists(readme_path):
+                with open(readme_path, "rb") as f:
+                    content = f.read()
+                break
+
+    try:
+        lines = content.decode("utf-8").splitlines(keepends=True)
+        if len(lines) < 25:
+            return "".join(lines)
+        else:
+            return "".join(lines[:25])
+    except UnicodeDecodeError:
+        return "unicode_decode_error"
+    except Exception as e:
+        print(f"Error reading README.md for {repo_path}: {e}")
+        return None
+
+
+def fetch_blobs(repo_path, shas):
+    """
+    Download missing blobs 'shas' into partial clone at 'repo_path' with a
+    single request, the same way git fetches missing objects on demand.
+    """
+    subprocess.run(
+        ["git", "-C", repo_path, "-c", "fetch.negotiationAlgorithm=noop"]
+        + ["fetch", "--quiet", "origin", "--no-tags", "--no-write-fetch-head"]
+        + ["--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+        input=b"".join(sha + b"\n" for sha in shas),
+        check=True,
+        capture_output=True,
+        env=GIT_ENV,
+    )
+
+
+def clone_repo(task, verbose=False):
+    """
+    Make blobless partial clone of the latest commit and download blobs of
+    files matching task's language. Regular clones get sparse checkout of
+    those files, bare clones (task.bare) have no working tree at all and
+    are meant for extraction straight from the object store. Returns
+    CloneResult.
+    """
+    git = ["git", "-C", task.path]
+    patterns = get_sparse_patterns(task.lang)
+    clone = ["git", "clone", "--quiet", "--filter=blob:none", "--no-checkout"]
+    clone += ["--depth", "1"]
+
+    if task.branch:
+        clone += ["--branch", task.branch]
+
+    if task.bare:
+        clone += ["--bare"]
+
+    if verbose:
+        console.print(f"Sparse checkout of {task.path}: {patterns}")
+
+    try:
+        subprocess.run(
+            clone + [task.url, task.path], check=True, capture_output=True, env=GIT_ENV
+        )
+
+        if task.bare:
+            fetch_blobs(
+                task.path,
+                [
+                    sha
+                    for path, sha in list_git_blobs(task.path)
+                    if is_ext_valid(task.lang, path) or path in README_FILES
+                ],
+            )
+        else:
+            for cmd in [
+                git + ["sparse-checkout", "set", "--no-cone", *patterns],
+                git + ["checkout"],
+            ]:
+                subprocess.run(cmd, check=True, capture_output=True, env=GIT_ENV)
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode("utf-8", errors="replace").strip()
+        return CloneResult(task.repo_id, task.path, None, 0, error)
+
+    return CloneResult(
+        task.repo_id,
+        task.path,
+        read_readme(task.path, task.bare),
+        get_fetched_bytes(task.path),
+        None,
+    )
+
+
+def clone_all(tasks, workers=CLONE_WORKERS, verbose=False):
+    """
+    Clone repositories described by 'tasks' using pool of 'workers' threads.
+    Yields CloneResult for each task as soon as it is finished and prints
+    throughput at the end.
+    """
+    start = time.time()
+    cloned, fetched = 0, 0
+
+    with ThreadPool(workers) as pool:
+        for result in pool.imap_unordered(partial(clone_repo, verbose=verbose), tasks):
+            if result.error is None:
+                cloned += 1
+                fetched += result.fetched
+                console.print(f"Cloned {result.path} ({result.fetched / 2**20:.1f} MB)")
+            else:
+                console.print(f"Failed to clone {result.path}: {result.error}")
+
+            yield result
+
+    elapsed = max(time.time() - start, 1e-6)
+    console.print(
+        f"Cloned {cloned}/{len(tasks)} repositories in {elapsed:.1f}s: "
+        f"{cloned / elapsed * 60:.1f} repos/min, {fetched / 2**20:.1f} MB fetched "
+        f"({fetched / 2**20 / elapsed:.2f} MB/s)",
+        style="green",
+    )
+
+
+def clone_repos(
+    dest_dir,
+    force=False,
+    only_missing=False,
+    verbose=False,
+    workers=CLONE_WORKERS,
+    clone_url=CLONE_URL,
+    bare=False,
+):
     """
     Clone repository for each repo in 'repos' table. For each repo, fill in
-    'path' and 'readme' columns.
+    'path' and 'readme' columns. Repositories are cloned in parallel by
+    'workers' threads. 'clone_url' is a template of remote's URL, formatted
+    with repo's owner and name. With 'bare', no working tree is created and
+    functions have to be extracted with 'git' source.
     """
-    file_extensions = [ext for lang in LANG_TO_EXT.values() for ext in lang]
     repos = get_repos()
 
     if only_missing:
         repos = repos.filter(Repo.path == None)
 
-    repos = repos.all()
-
-    token = os.getenv("GITHUB_TOKEN", None)
-    headers = {"Authorization": f"Bearer {token}"}
+    repos = [
+        repo
+        for repo in repos.all()
+        if repo.lang in LANG_TO_EXT and (force or not repo.path)
+    ]
 
     if not os.path.exists(dest_dir):
         os.makedirs(dest_dir)
 
-    for repo in repos:
-        if repo.lang != "javascript":
-            continue
-
-        if repo.path and not force:
-            continue
+    # Repositories without known default branch are cloned from remote's HEAD
+    download_repos_metadata([repo for repo in repos if repo.default_branch is None])
+    repos_by_id = {}
+    tasks = []
 
+    for repo in repos:
         dest_repo_path = os.path.join(dest_dir, repo.lang, f"{repo.owner}_{repo.name}")
 
         if os.path.exists(dest_repo_path):
             if force:
                 console.print(f"'{repo.name}' already cloned, deleting")
-                subprocess.run(["rm", "-r", "-f", dest_repo_path])
+                shutil.rmtree(dest_repo_path)
             else:
                 console.print(f"'{repo.name}' already cloned, skipping")
                 continue
 
-        console.print(f"Cloning {repo.name} into {dest_repo_path}...")
-        url = f"https://github.com/{repo.owner}/{repo.name}.git"
+        repos_by_id[repo.id] = repo
+        url = clone_url.format(owner=repo.owner, name=repo.name)
+        tasks.append(
+            CloneTask(
+                repo.id, url, dest_repo_path, repo.lang, repo.default_branch, bare
+            )
+        )
 
-        # Initialize a new git repository
-        subprocess.run(["git", "init", dest_repo_path])
-        subprocess.run(["git", "-C", dest_repo_path, "remote", "add", "origin", url])
+    for result in clone_all(tasks, workers, verbose):
+        if result.error is None:
+            update_repo(
+                repos_by_id[result.repo_id], path=result.path, readme=result.readme
+            )
 
-        # Enable sparse-checkout
-        subprocess.run(
-            ["git", "-C", dest_repo_path, "config", "core.sparseCheckout", "true"]
-        )
 
-        # Specify the files to checkout
-        sparse_checkout_path = os.path.join(
-            dest_repo_path, ".git", "info", "sparse-checkout"
+async def get_first_commit_date_from_api(client, repo):
+    """
+    Get the date of the first commit of 'repo' using Github API. Commits are
+    listed one per page, so the first commit is the only one on the last
+    page, which is found in 'Link' header of the first page. This takes at
+    most two requests regardless of the size of the history.
+    """
+    url = f"/repos/{repo.owner}/{repo.name}/commits"
+    response = await client.get(url, {"per_page": 1})
+
+    if response.status_code == 200 and "last" in response.links:
+        last_page = httpx.URL(response.links["last"]["url"]).params["page"]
+        response = await client.get(url, {"per_page": 1, "page": last_page})
+
+    if response.status_code != 200 or not response.json():
+        console.print(
+            f"Failed to retrieve commits of {repo.name}: {response.status_code}"
         )
-        with open(sparse_checkout_path, "w") as sparse_file:
-            if file_extensions:
-                for extension in file_extensions:
-                    if verbose:
-                        console.print(f"Adding {extension} to sparse checkout")
-                    sparse_file.write(f"*{extension}\n")
-            else:
-                sparse_file.write(
-                    "*\n"
-                )  # Checkout all files if no extension is specified
-
-            # Add readme files to sparse checkout
-            sparse_file.write("README.md\n")
-            sparse_file.write("readme.md\n")
-            sparse_file.write("README.txt\n")
-            sparse_file.write("readme.txt\n")
-            sparse_file.write("README.rst\n")
-            sparse_file.write("readme.rst\n")
-            sparse_file.write("readme\n")
-            sparse_file.write("README\n")
-
-        # Fetch the default branch using GitHub API
-        repo_api_url = f"https://api.github.com/repos/{repo.owner}/{repo.name}"
-        response = requests.get(repo_api_url, headers=headers)
-        if response.status_code == 200:
-            default_branch = response.json().get("default_branch", "main")
-        else:
-            console.print(
-                f"Failed to get default branch for {repo.name}, using 'main' as fallback"
-            )
-            default_branch = "main"
+        return None
 
-        # Perform the checkout using the default branch
-        subprocess.run(
-            [
-                "git",
-                "-C",
-                dest_repo_path,
-                "pull",
-                "origin",
-                default_branch,
-                "--depth",
-                "1",
-            ]
+    first_commit = response.json()[-1]
+    return datetime.strptime(
+        first_commit["commit"]["committer"]["date"], GITHUB_DATE_FORMAT
+    )
+
+
+def get_first_commit_date_from_clone(repo_path):
+    """
+    Get the date of the first commit from local clone at 'repo_path'.
+    Clones made by clone_repo are shallow, their history is fetched first
+    without trees or blobs (commits only), so this takes one extra request
+    to the remote. Returns None if there is no clone or history can't be
+    fetched.
+    """
+    if not repo_path or not os.path.exists(repo_path):
+        return None
+
+    git = ["git", "-C", repo_path]
+    shallow = subprocess.run(
+        git + ["rev-parse", "--is-shallow-repository"], capture_output=True, text=True
+    )
+
+    if shallow.returncode != 0:
+        return None
+
+    if shallow.stdout.strip() == "true":
+        unshallow = subprocess.run(
+            git + ["fetch", "--quiet", "--unshallow", "--filter=tree:0", "origin"],
+            capture_output=True,
+            env=GIT_ENV,
         )
 
-        # ... existing code for reading README and updating repo ...
-        # Read the entire README.md and decide how much to save
-        readme_content = ""
-        readme_files = [
-            "README.md",
-            "readme.md",
-            "README.txt",
-            "readme.txt",
-            "README.rst",
-            "readme.rst",
-            "readme",
-            "README",
-        ]
-
-        for readme_file in readme_files:
-            readme_path = os.path.join(dest_repo_path, readme_file)
-            if os.path.exists(readme_path):
-                break
-        else:
-            readme_path = None
+        if unshallow.returncode != 0:
+            return None
 
-        try:
-            with open(readme_path, "r", encoding="utf-8") as readme_file:
-                lines = readme_file.readlines()
-                if len(lines) < 25:
-                    readme_content = "".join(lines)
-                else:
-                    readme_content = "".join(lines[:25])
-        except Exception as e:
-            readme_content = None
-            print(f"Error reading README.md for {repo.name}: {e}")
-        except UnicodeDecodeError:
-            readme_content = "unicode_decode_error"
+    # There may be more than one root commit if unrelated histories were merged
+    roots = subprocess.run(
+        git + ["log", "--max-parents=0", "--format=%ct", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    timestamps = [int(line) for line in roots.stdout.split()]
 
-        update_repo(repo, path=dest_repo_path, readme=readme_content)
+    if roots.returncode != 0 or not timestamps:
+        return None
 
+    return datetime.fromtimestamp(min(timestamps), timezone.utc).replace(tzinfo=None)
 
-def get_first_commit_date(repo_id):
-    """
-    Get the date of the first commit in a GitHub repository.
 
-    :param owner: Owner of the repository
-    :param repo: Name of the repository
-    :return: Date of the first commit as a string
+async def get_first_commit_date(client, repo):
     """
-    token = os.getenv("GITHUB_TOKEN", None)
-    headers = {"Authorization": f"Bearer {token}"}
+    Get the date of the first commit of 'repo' from Github API, falling back
+    to local clone if API request fails.
+    """
+    date = await get_first_commit_date_from_api(client, repo)
 
-    # GitHub API URL to list commits
-    url = f"https://api.github.com/repos/{owner}/{repo}/commits"
+    if date is None:
+        date = get_first_commit_date_from_clone(repo.path)
 
-    # Parameters to get all commits
-    params = {"per_page": 100, "page": 1}
+    return date
 
-    all_commits = []
 
-    while True:
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code != 200:
-            print(f"Failed to retrieve commits: {response.status_code}")
-            return None
+async def get_first_commit_dates(repos):
+    async with GithubClient(cache=ResponseCache.from_env()) as client:
+        dates = await asyncio.gather(
+            *[get_first_commit_date(client, repo) for repo in repos]
+        )
 
-        commits = response.json()
-        if not commits:
-            break
+    return {repo.id: date for repo, date in zip(repos, dates)}
 
-        all_commits.extend(commits)
-        params["page"] += 1
 
-    # The first commit is the last one in the list
-    first_commit = all_commits[-1]
-    first_commit_date = first_commit["commit"]["committer"]["date"]
+def download_first_commit_dates(repos):
+    """
+    Fill in 'first_commit_at' column of 'repos' which don't have it yet.
+    """
+    repos = [repo for repo in repos if repo.first_commit_at is None]
+    dates = asyncio.run(get_first_commit_dates(repos))
+
+    for repo in repos:
+        if dates[repo.id] is not None:
+            update_repo_first_commit(repo, dates[repo.id])
 
-    return first_commit_date
+    commit()
+    found = sum(1 for date in dates.values() if date is not None)
+    console.print(f"Found first commit dates of {found}/{len(repos)} repositories")
+
+
+async def download_pages(lang, per_page, max_page):
+    """
+    Download all search result pages concurrently, pacing requests according
+    to search API rate limit.
+    """
+    async with GithubClient(cache=ResponseCache.from_env()) as client:
+        return await asyncio.gather(
+            *[
+                get_top_repos_by_language(client, lang, per_page, page)
+                for page in range(1, max_page + 1)
+            ]
+        )
 
 
 def download_repos(lang, dest_dir, num_projects):
     """
     Download top 'num_projects' repositories for specified language and save their
-    info to the database.
-
-    Note: This function does not check for IntegrityError - table must be empty!
+    info to the database. Repositories which are already present are updated.
     """
     per_page = min(num_projects, 100)
     max_page = math.ceil(num_projects / per_page)
-    delay = os.getenv("GITHUB_REQUEST_DELAY", 2)
     console.print(f"Looking for repositories, per_page={per_page}, max_page={max_page}")
+    pages = asyncio.run(download_pages(lang, per_page, max_page))
 
-    for page in range(1, max_page + 1):
-        console.print(f"Downloading page {page}/{max_page} for {lang}", style="yellow")
-        repos = get_top_repos_by_language(lang, per_page, page)
-        time.sleep(delay)
-
-        for repo in repos:
-            console.print(f'Adding {repo["full_name"]}')
-            add_repo(
+    for page, repos in enumerate(pages, start=1):
+        console.print(
+            f"Adding page {page}/{max_page} for {lang} ({len(repos)} repositories)",
+            style="yellow",
+        )
+        add_repos(
+            dict(
                 id=repo["id"],
                 name=repo["name"],
                 stars=repo["stargazers_count"],
@@ -244,3 +533,5 @@ def download_repos(lang, dest_dir, num_projects):
                 lang=lang,
                 owner=repo["owner"]["login"],
             )
+            for repo in repos
+        )
@@ -1,102 +1,438 @@
+import math
+import multiprocessing
 import os
-import random
+import resource
+import time
+import zlib
 from itertools import repeat
-from multiprocessing import Pool
+from multiprocessing import Pool, Process, Queue
 
 from rich.console import Console
 from tree_sitter import Language, Parser
 
 from db.engine import get_engine
 from db.utils import *
-from scripts.lang import LANGS, is_ext_valid
+from scripts.extract.prefilter import Prefilter, content_skip_reason
+from scripts.extract.sampling import estimate_functions, sample_files
+from scripts.extract.sources import SOURCES, hash_content, prefetch
+from scripts.extract.writer import WRITER_QUEUE_SIZE, WriterClient, run_writer
+from scripts.lang import LANGS
 from scripts.parsing.parsers import *
 
-POOL_SIZE = 4
+# Number of worker processes, None to use all available cores
+POOL_SIZE = None
 MAX_FUNCTIONS = 10000
+# Repositories larger than this (in KB, as reported by Github) are split into
+# batches of files, which are extracted by separate workers
+BATCH_SIZE_KB = 50 * 1024
+# Time budget for parsing and extracting a single file, in seconds
+PARSE_TIMEOUT = 10
+PARSE_TIMEOUT_PER_MB = 30
+# Worker whose peak RSS exceeds this many MB stops and its task is resumed in
+# a new worker. File which alone used over half of it is quarantined.
+MAX_WORKER_RSS_MB = 2048
+
+# Queue of writer process in pool workers, see init_worker
+writer_queue = None
+# Seconds between checks that writer process is alive while waiting for tasks
+WRITER_CHECK_INTERVAL = 5
 
 console = Console()
 
 
-def extract_repo(repo, lang):
+def is_unchanged(indexed, source_file):
+    """
+    Return True if 'source_file' is known to match its indexed version
+    without reading it: by git blob id if the source provides it, otherwise
+    by size and modification time.
+    """
+    if source_file.hash is not None:
+        return source_file.hash == indexed.hash
+
+    return (
+        source_file.mtime is not None
+        and source_file.size == indexed.size
+        and source_file.mtime == indexed.mtime
+    )
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def in_batch(path, batch):
+    """
+    Return True if file at 'path' belongs to 'batch', an (index, count)
+    tuple. Files are assigned to batches by hash of their path, so a file
+    stays in the same batch across runs.
+    """
+    index, count = batch
+    return count == 1 or zlib.crc32(path.encode()) % count == index
+
+
+def plan_tasks(repos, processes, source="files", engine="walk", sample=False):
+    """
+    Return arguments of extract_repo for each (repo, lang) pair in 'repos',
+    largest first by repository size. Repositories above BATCH_SIZE_KB are
+    split into up to 'processes' batches of files, which are ordered by
+    their share of the repository's size.
+    """
+    tasks = []
+
+    for repo, lang in repos:
+        size = repo.size or 0
+        count = min(max(math.ceil(size / BATCH_SIZE_KB), 1), processes)
+
+        for index in range(count):
+            args = ((repo.id, repo.name, repo.path), lang, source, engine, sample)
+            tasks.append((size / count, args + ((index, count),)))
+
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    return [args for _, args in tasks]
+
+
+def parse_timeout(size):
+    return PARSE_TIMEOUT + PARSE_TIMEOUT_PER_MB * size / 2**20
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def estimate_file(source_file, index, lang):
+    """
+    Return number of functions of unchanged indexed file, or estimate it
+    from contents (no functions if prefilter would skip the file).
+    """
+    indexed = index.get(source_file.path)
+
+    if indexed is not None and is_unchanged(indexed, source_file):
+        return indexed.functions
+
+    content = source_file.load()
+
+    if content_skip_reason(content) is not None:
+        return 0
+
+    return estimate_functions(lang, content)
+
+
+def wait_for_task(task, writer):
+    """
+    Return result of pool 'task'. Raises RuntimeError if 'writer' process
+    exits meanwhile: workers would block on its full queue forever and rows
+    sent to it would be lost.
+    """
+    while True:
+        try:
+            return task.get(timeout=WRITER_CHECK_INTERVAL)
+        except multiprocessing.TimeoutError:
+            if not writer.is_alive():
+                raise RuntimeError(f"Writer exited with code {writer.exitcode}")
+
+
+def run_tasks(target, tasks, processes, queue, writer):
+    """
+    Run 'target' (extract_repo) with each of 'tasks' arguments in a pool of
+    'processes' workers sending messages to 'queue' of 'writer' process, and
+    yield results in order of submission. Each task runs in a new worker,
+    so memory held by one repository is released before the next one.
+    Interrupted tasks are resubmitted with files they have already
+    processed, which are skipped. If the writer dies, the pool is terminated
+    instead of waiting forever.
+    """
+    with Pool(processes, init_worker, (queue,), maxtasksperchild=1) as p:
+        pending = [(args, p.apply_async(target, args)) for args in tasks]
+
+        while pending:
+            args, task = pending.pop(0)
+            result = wait_for_task(task, writer)
+            resume = result[2]
+            yield result
+
+            if resume is not None:
+                args = args[:6] + resume
+                pending.append((args, p.apply_async(target, args)))
+
+        # Leaving the block terminates workers, which may still be writing
+        # queued messages to the pipe, let them exit on their own instead
+        p.close()
+        p.join()
+
+
+def init_worker(queue):
+    global writer_queue
+    writer_queue = queue
+    release_inherited_connections()
+
+
+def extract_repo(
+    repo,
+    lang,
+    source="files",
+    engine="walk",
+    sample=False,
+    batch=(0, 1),
+    done=(),
+    counted=0,
+):
+    """
+    Extract functions of 'lang' from repository and save them to database.
+    'source' selects how files are read (see SOURCES): 'files' walks checked
+    out working tree, 'git' reads blobs from repository's object store and
+    'archive' streams files from tar or zip archive at repository's path.
+    'engine' selects extractor of the language (see get_extractor).
+    Only files in 'batch' are processed (see in_batch), each batch extracts
+    its share of MAX_FUNCTIONS. With 'sample', functions of all files are
+    first estimated by a lexical pre-scan and only a uniform sample of files
+    with about MAX_FUNCTIONS functions is parsed (see sample_files),
+    otherwise files are parsed in listing order until MAX_FUNCTIONS.
+
+    Vendored, generated, minified and oversized files are not parsed (see
+    Prefilter), those rejected by their contents are recorded with reason.
+    Processed files are recorded in 'files' table, files which have not
+    changed since the previous run are skipped, functions of modified files
+    are replaced and functions of deleted files are removed.
+
+    Functions of each file are sent to writer process through
+    'writer_queue' (see scripts/extract/writer.py), or written directly
+    outside of worker pool. A file's stat is recorded only together with
+    its functions, so files interrupted by a crash are extracted again.
+
+    Files which fail to parse, exceed their time budget (see parse_timeout)
+    or push worker's memory over MAX_WORKER_RSS_MB are quarantined and
+    skipped by later runs until their contents change. Returns [successes,
+    errors, resume, stats], where 'resume' is (paths processed so far,
+    functions counted towards MAX_FUNCTIONS) if the worker stopped early to
+    be replaced (pass them back as 'done' and 'counted', the writer may not
+    have committed those files yet) or is None, and 'stats' is dict of files
+    and functions extracted and seconds spent parsing and waiting for writer.
+    """
     repo_id, repo_name, repo_path = repo
     successes = []
     errors = []
-    extracted_functions = 0
+    extracted_functions = counted
+    max_functions = math.ceil(MAX_FUNCTIONS / batch[1])
 
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", lang))
+    extract_fn = get_extractor(lang, engine)
     console.print(f"Processing {repo_name} ({lang}) -> {repo_path}", style="bold red")
     session = init_local_session()
+    index = {
+        path: file
+        for path, file in get_file_index(session, repo_id).items()
+        if in_batch(path, batch)
+    }
+    quarantined = get_quarantined_hashes(session, repo_id)
+    session.close()
+    writer = WriterClient(writer_queue)
+    done = set(done)
+    seen = set(done)
+    resume = None
+    skipped = 0
+    prefilter = Prefilter(repo_path)
+    parsed_files = 0
+    parsed_bytes = 0
+    parsed_functions = 0
+    parse_time = 0
 
     try:
-        for file in list_files(repo_path):
-            if ".git" in file:
+        files = (
+            f
+            for f in SOURCES[source](repo_path, lang)
+            if in_batch(f.path, batch) and prefilter.skip_path(f) is None
+        )
+        unchanged = lambda f: f.path in index and is_unchanged(index[f.path], f)
+
+        if sample:
+            selected, num_files, estimated = sample_files(
+                prefetch(files, skip=unchanged),
+                lambda f: estimate_file(f, index, lang),
+                max_functions,
+                repo_id,
+                repo_path,
+            )
+            console.print(
+                f"Sampled {len(selected)} of {num_files} files of {repo_name} "
+                f"with about {estimated} functions"
+            )
+            files = (f for f in SOURCES[source](repo_path, lang) if f.path in selected)
+
+        files = (f for f in files if f.path not in done)
+
+        for source_file in prefetch(files, skip=unchanged):
+            file = source_file.path
+            indexed = index.get(file)
+            seen.add(file)
+
+            if indexed is not None and is_unchanged(indexed, source_file):
+                extracted_functions += indexed.functions
+                skipped += 1
+                continue
+
+            content = source_file.load()
+            content_hash = source_file.hash or hash_content(content)
+            stat = (source_file.size, source_file.mtime, content_hash)
+
+            if quarantined.get(storable_path(file)) == content_hash:
+                # Quarantined files are retried once their contents change
                 continue
 
-            if "readme" in file.lower() or not is_ext_valid(lang, file):
+            if indexed is not None and indexed.hash == content_hash:
+                # Touched but not modified, remember new size and mtime
+                writer.send("touch", repo_id, file, *stat)
+                extracted_functions += indexed.functions
+                skipped += 1
+                continue
+
+            reason = prefilter.skip_content(content)
+
+            if reason is not None:
+                writer.send("file", repo_id, file, stat, [], reason)
                 continue
 
             console.print(f"Processing file: {file}")
 
-            file_order = 1
+            rows = []
+            start = time.perf_counter()
+            rss_before = peak_rss_mb()
             try:
-                fnames = extract(parser, file, globals()[f"extract_{lang}"])
-
-                for fname, names in fnames.items():
-                    names = " ".join(names)
-                    if fname != None and "test" in fname:
+                timeout = parse_timeout(len(content))
+                for record in stream(parser, content, extract_fn, file, timeout):
+                    if record.name != None and "test" in record.name:
                         continue
-                    add_function(session, fname, names, repo_id, file, lang, file_order)
-                    file_order += 1
+                    rows.append(
+                        (
+                            record.name,
+                            " ".join(record.identifiers),
+                            record.file,
+                            lang,
+                            len(rows) + 1,
+                        )
+                    )
                     extracted_functions += 1
 
-                    if extracted_functions >= MAX_FUNCTIONS:
+                    if extracted_functions >= max_functions:
                         break
 
                     successes.append(file)
             except Exception as e:
-                console.print("Failed to parse")
+                console.print(f"Failed to parse {file}, quarantining it")
                 console.print(e)
-                raise e
+                reason = "timeout" if isinstance(e, ParseTimeout) else "error"
+                writer.send("quarantine", repo_id, file, content_hash, reason, str(e))
+                extracted_functions -= len(rows)
+                errors.append(file)
                 continue
 
-            if extracted_functions >= MAX_FUNCTIONS:
+            parse_time += time.perf_counter() - start
+            parsed_files += 1
+            parsed_bytes += len(content)
+            parsed_functions += len(rows)
+            writer.send("file", repo_id, file, stat, rows)
+            peak = peak_rss_mb()
+
+            if peak > MAX_WORKER_RSS_MB:
+                if peak - rss_before > MAX_WORKER_RSS_MB / 2:
+                    detail = f"peak RSS grew from {rss_before:.0f} to {peak:.0f} MB"
+                    writer.send(
+                        "quarantine", repo_id, file, content_hash, "memory", detail
+                    )
+                    errors.append(file)
+
+                if extracted_functions < max_functions:
+                    console.print(f"Worker reached {peak:.0f} MB, stopping {repo_name}")
+                    resume = (list(seen), extracted_functions)
+
+                break
+
+            if extracted_functions >= max_functions:
                 break
+        else:
+            # Whole repository was listed, files missing from it were deleted
+            writer.send("retire", repo_id, [path for path in index if path not in seen])
+
+        console.print(f"Skipped {skipped} unchanged files of {repo_name}")
+        console.print(
+            prefilter.summary(parse_time / parsed_bytes if parsed_bytes else None)
+        )
     except Exception as e:
         raise e
         console.print(e)
         console.print(file)
         errors.append(file)
     finally:
-        session.close()
-        return [successes, errors]
-
-
-def list_files(directory):
-    console.print(directory)
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for filename in filenames:
-            yield os.path.join(dirpath, filename)
+        writer.close()
+        stats = dict(
+            files=parsed_files,
+            functions=parsed_functions,
+            parse_time=parse_time,
+            blocked=writer.blocked,
+        )
+        return [successes, errors, resume, stats]
 
 
 class Functions:
     @staticmethod
-    def extract(langs):
+    def extract(langs, source="files", engine="walk", incremental=False, sample=False):
+        """
+        Extract functions from repositories without functions, or from all
+        cloned repositories if 'incremental' (only new or modified files are
+        parsed then, see extract_repo). Repositories of all languages share
+        a single pool of workers and are scheduled largest first, so large
+        repositories do not delay the end of the run. With 'sample', uniform
+        sample of files of large repositories is parsed instead of the first
+        files (see extract_repo). Workers only parse,
+        extracted functions are written by a separate writer process fed
+        through a bounded queue.
+        """
         session = init_local_session()
         results = [[], []]
+        repos = []
 
         for lang in langs:
-            repos = Repo.get_without_functions(session, lang)
-            random.shuffle(repos)
-            console.print([repo.name for repo in repos])
-
-            with Pool(POOL_SIZE) as p:
-                result = p.starmap(
-                    extract_repo,
-                    [((repo.id, repo.name, repo.path), lang) for repo in repos],
-                )[0]
-                results[0].extend(result[0])
-                results[1].extend(result[1])
+            if incremental:
+                lang_repos = [r for r in Repo.all(session, lang=lang) if r.path]
+            else:
+                lang_repos = Repo.get_without_functions(session, lang)
+
+            console.print([repo.name for repo in lang_repos])
+            repos += [(repo, lang) for repo in lang_repos]
+
+        session.close()
+        processes = POOL_SIZE or available_cores()
+        tasks = plan_tasks(repos, processes, source, engine, sample)
+        console.print(f"Extracting {len(repos)} repositories in {len(tasks)} tasks")
+        queue = Queue(WRITER_QUEUE_SIZE)
+        writer = Process(target=run_writer, args=(queue, WRITER_QUEUE_SIZE))
+        writer.start()
+        totals = dict(files=0, functions=0, parse_time=0, blocked=0)
+        start = time.perf_counter()
+
+        for successes, errors, _, stats in run_tasks(
+            extract_repo, tasks, processes, queue, writer
+        ):
+            results[0].extend(successes)
+            results[1].extend(errors)
+
+            for key, value in stats.items():
+                totals[key] += value
+
+        console.print(
+            f"Parse workers: {totals['files']} files, {totals['functions']} "
+            f"functions in {time.perf_counter() - start:.1f}s, "
+            f"{totals['functions'] / max(totals['parse_time'], 1e-9):,.0f} "
+            f"functions/s per worker, {totals['blocked']:.1f}s waiting for writer"
+        )
+        if not writer.is_alive():
+            raise RuntimeError(f"Writer exited with code {writer.exitcode}")
 
+        queue.put(None)
+        writer.join()
         console.print(f"Successes: {len(results[0])}, failures: {len(results[1])}")
         console.print(results[1])
@@ -0,0 +1,144 @@
+import os
+import re
+from collections import Counter
+
+# Directories holding third-party code bundled with a repository
+VENDORED_DIRS = {
+    "bower_components",
+    "extern",
+    "external",
+    "node_modules",
+    "third-party",
+    "third_party",
+    "thirdparty",
+    "vendor",
+    "vendored",
+}
+# File name suffixes of minified bundles and output of code generators
+GENERATED_SUFFIXES = (
+    ".min.js",
+    "-min.js",
+    ".bundle.js",
+    "_pb2.py",
+    "_pb2_grpc.py",
+    ".tab.c",
+    ".yy.c",
+)
+# Larger files are amalgamations (sqlite3.c) or generated tables and parsers
+MAX_FILE_SIZE = 1024 * 1024
+# Content heuristics look only at this many bytes from the start of file
+SAMPLE_SIZE = 4096
+MAX_LINE_LENGTH = 1000
+MIN_WHITESPACE_RATIO = 0.05
+# Generated files announce themselves in a comment on one of the first lines
+HEADER_LINES = 5
+GENERATED_MARKERS = re.compile(
+    rb"@generated|do not (edit|modify)|auto-?generated"
+    rb"|(file|code) (was |is )?(automatically )?generated",
+    re.IGNORECASE,
+)
+WHITESPACE = re.compile(rb"\s")
+
+
+def path_skip_reason(path, size=None):
+    """
+    Return reason for skipping file at 'path' (relative to repository) and
+    of 'size' bytes, if known, or None if it should be parsed.
+    """
+    parts = path.lower().split(os.sep)
+
+    if any(part in VENDORED_DIRS for part in parts[:-1]):
+        return "vendored"
+
+    if parts[-1].endswith(GENERATED_SUFFIXES):
+        return "generated"
+
+    if size is not None and size > MAX_FILE_SIZE:
+        return "oversized"
+
+    return None
+
+
+def content_skip_reason(content):
+    """
+    Return reason for skipping file with 'content' (bytes) based on its
+    size and first SAMPLE_SIZE bytes, or None if it should be parsed.
+    """
+    if len(content) > MAX_FILE_SIZE:
+        return "oversized"
+
+    sample = content[:SAMPLE_SIZE]
+    lines = sample.split(b"\n")
+
+    if GENERATED_MARKERS.search(b"\n".join(lines[:HEADER_LINES])):
+        return "generated"
+
+    # Last line may be cut off by the sample, unless it is the whole file
+    if len(content) > SAMPLE_SIZE and len(lines) > 1:
+        lines = lines[:-1]
+
+    if max(map(len, lines)) > MAX_LINE_LENGTH:
+        return "minified"
+
+    if len(sample) >= SAMPLE_SIZE // 4:
+        whitespace = len(WHITESPACE.findall(sample))
+
+        if whitespace / len(sample) < MIN_WHITESPACE_RATIO:
+            return "minified"
+
+    return None
+
+
+class Prefilter:
+    """
+    Decides which files of repository at 'repo_path' are not worth parsing:
+    vendored, generated, minified or oversized files. Path rules are checked
+    before a file is loaded, content heuristics afterwards. Skipped files
+    and their bytes are counted by reason.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.files = Counter()
+        self.bytes = Counter()
+
+    def skip_path(self, source_file):
+        path = os.path.relpath(source_file.path, self.repo_path)
+        reason = path_skip_reason(path, source_file.size)
+
+        if reason is not None:
+            self.record(reason, source_file.size or 0)
+
+        return reason
+
+    def skip_content(self, content):
+        reason = content_skip_reason(content)
+
+        if reason is not None:
+            self.record(reason, len(content))
+
+        return reason
+
+    def record(self, reason, size):
+        self.files[reason] += 1
+        self.bytes[reason] += size
+
+    def summary(self, seconds_per_byte=None):
+        """
+        Return description of skipped files, with parse time saved estimated
+        from 'seconds_per_byte' of parsed files if given.
+        """
+        if not self.files:
+            return "No files skipped by prefilter"
+
+        reasons = ", ".join(
+            f"{reason}: {count} ({self.bytes[reason] / 2**20:.1f} MB)"
+            for reason, count in self.files.most_common()
+        )
+        summary = f"Prefilter skipped {sum(self.files.values())} files, {reasons}"
+
+        if seconds_per_byte is not None:
+            saved = sum(self.bytes.values()) * seconds_per_byte
+            summary += f", about {saved:.1f}s saved"
+
+        return summary
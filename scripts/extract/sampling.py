@@ -0,0 +1,76 @@
+import hashlib
+import heapq
+import os
+import re
+
+# Starts of function definitions, including function's name, counted by the
+# lexical pre-scan. Counts are estimates, they only need to be roughly
+# proportional to numbers of functions found by the extractors.
+FUNCTION_PATTERNS = dict(
+    c=rb"(?m)^[A-Za-z_][\w \t\*]*\b\w+[ \t]*\([^;{}]*\)[ \t\r\n]*\{",
+    clojure=rb"\((?:defn-?|defmacro|defmethod)\s+[^\s()]+",
+    elixir=rb"(?m)^[ \t]*(?:def|defp|defmacro)\s+\w+",
+    erlang=rb"(?m)^[a-z]\w*\(",
+    fortran=rb"(?im)^(?![ \t]*end)[^!\n]*\b(?:subroutine|function)[ \t]+\w+",
+    haskell=rb"(?m)^[a-z_][\w']*[ \t][^\n]*?=",
+    java=rb"(?m)^[ \t]*(?:(?:public|protected|private|static|final|abstract"
+    rb"|synchronized)\s+)+[\w<>\[\],. ]+?\s+\w+\s*\([^;]*?\)[^;{]*\{",
+    javascript=rb"\bfunction\b|=>",
+    ocaml=rb"(?m)^[ \t]*let(?:[ \t]+rec)?[ \t]+\w+[ \t]+[\w(~?]",
+    python=rb"(?m)^[ \t]*(?:async[ \t]+)?def[ \t]+\w+",
+)
+FUNCTION_PATTERNS = {
+    lang: re.compile(pattern) for lang, pattern in FUNCTION_PATTERNS.items()
+}
+# Used for languages without pattern
+BYTES_PER_FUNCTION = 1000
+
+
+def estimate_functions(lang, content):
+    """
+    Estimate number of functions in 'content' (bytes) without parsing it.
+    Like extract_repo, functions with "test" in their name are not counted.
+    """
+    if lang not in FUNCTION_PATTERNS:
+        return len(content) // BYTES_PER_FUNCTION
+
+    matches = FUNCTION_PATTERNS[lang].finditer(content)
+    return sum(1 for match in matches if b"test" not in match.group())
+
+
+def rank(seed, path):
+    """
+    Return pseudo-random rank of 'path' in [0, 1), fixed for given 'seed'.
+    """
+    digest = hashlib.blake2b(f"{seed}:{path}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def sample_files(files, estimate, cap, seed, root=""):
+    """
+    Return (paths, number of files, estimated functions) of a uniform
+    sample of SourceFile from 'files' whose functions, estimated by
+    'estimate', add up to 'cap'. All files are returned if there are fewer
+    functions. Files are ranked by hash of 'seed' and path relative to
+    'root', so the same files are picked on each run and the sample changes
+    little when files are added or removed. Files are streamed through a
+    reservoir which holds only the lowest ranked files needed to reach cap.
+    """
+    reservoir = []  # Heap of (-rank, path, estimate), highest rank first
+    in_reservoir = 0
+    num_files = 0
+    total = 0
+
+    for source_file in files:
+        count = estimate(source_file)
+        num_files += 1
+        total += count
+        file_rank = rank(seed, os.path.relpath(source_file.path, root))
+        heapq.heappush(reservoir, (-file_rank, source_file.path, count))
+        in_reservoir += count
+
+        # Highest ranked file is not needed if the rest reaches cap alone
+        while reservoir and in_reservoir - reservoir[0][2] >= cap:
+            in_reservoir -= heapq.heappop(reservoir)[2]
+
+    return {path for _, path, _ in reservoir}, num_files, total
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import stat
+import subprocess
+import tarfile
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from scripts.extract.prefilter import VENDORED_DIRS
+from scripts.lang import get_exts, is_ext_valid
+from scripts.parsing.parsers import load_file
+
+# 'size' is in bytes, None if not known without reading the file. 'load' is
+# a callable returning contents of the file as bytes. 'mtime' (seconds since
+# epoch) and 'hash' (git blob id of contents) are None if not known upfront.
+SourceFile = namedtuple(
+    "SourceFile", ["path", "size", "load", "mtime", "hash"], defaults=[None, None]
+)
+
+# Git tree entries with this mode are symbolic links, not regular files
+GIT_SYMLINK_MODE = b"120000"
+# Directories which are not entered when listing files: version control
+# metadata and bundled third-party code (matched case-insensitively)
+IGNORED_DIRS = frozenset({".git", ".hg", ".svn"} | VENDORED_DIRS)
+
+
+def is_source_file(lang, path):
+    return "readme" not in path.lower() and is_ext_valid(lang, path)
+
+
+def hash_content(content):
+    """
+    Return git blob id of 'content', so files read from disk and blobs read
+    from git object store are hashed the same way.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def walk_files(directory, extensions=None, ignored_dirs=IGNORED_DIRS):
+    """
+    Yield os.DirEntry of each file under 'directory' with extension in
+    'extensions' (all files if None), in a single pass over directories.
+    Directories named in 'ignored_dirs' are pruned, symbolic links to
+    directories are not followed.
+    """
+    directories = [directory]
+
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name.lower() not in ignored_dirs:
+                        directories.append(entry.path)
+                elif extensions is None or (
+                    os.path.splitext(entry.name)[1] in extensions and entry.is_file()
+                ):
+                    yield entry
+
+
+def disk_files(repo_path, lang):
+    """
+    Yield SourceFile for each file of 'lang' in checked out repository.
+    """
+    for entry in walk_files(repo_path, frozenset(get_exts(lang))):
+        if "readme" in entry.name.lower():
+            continue
+
+        file_stat = entry.stat()
+        yield SourceFile(
+            entry.path,
+            file_stat.st_size,
+            partial(load_file, entry.path),
+            file_stat.st_mtime,
+        )
+
+
+def tracked_files(repo_path, lang):
+    """
+    Yield SourceFile for each file of 'lang' tracked in checked out git
+    repository, listed by 'git ls-files' from the index instead of walking
+    directories. Untracked and ignored files are left out. Falls back to
+    disk_files if 'repo_path' is not a git working tree.
+    """
+    if not os.path.exists(os.path.join(repo_path, ".git")):
+        yield from disk_files(repo_path, lang)
+        return
+
+    extensions = frozenset(get_exts(lang))
+    listing = subprocess.run(
+        ["git", "-C", repo_path, "ls-files", "-z", "--"]
+        + [f"*{ext}" for ext in extensions],
+        capture_output=True,
+        check=True,
+    ).stdout
+
+    for path in listing.split(b"\0"):
+        path = os.path.join(repo_path, os.fsdecode(path))
+        name = os.path.basename(path)
+
+        if "readme" in name.lower() or os.path.splitext(name)[1] not in extensions:
+            continue
+
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Deleted in working tree
+
+        if stat.S_ISREG(file_stat.st_mode):
+            yield SourceFile(
+                path, file_stat.st_size, partial(load_file, path), file_stat.st_mtime
+            )
+
+
+class GitObjectReader:
+    """
+    Reads objects from repository's object store through a single long-running
+    'git cat-file --batch' process. Use as context manager.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            ["git", "-C", self.repo_path, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process.wait()
+
+    def read(self, sha):
+        self.process.stdin.write(sha + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+
+        if len(header) != 3:
+            raise KeyError(f"object {sha.decode()} not found in {self.repo_path}")
+
+        content = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)  # Trailing newline
+        return content
+
+
+def list_git_blobs(repo_path, rev="HEAD"):
+    """
+    Return list of (path, sha) tuples of regular files in 'rev' of git
+    repository at 'repo_path'. Blobs themselves are not accessed, so this
+    does not trigger downloads in partial clones.
+    """
+    listing = subprocess.run(
+        ["git", "-C", repo_path, "ls-tree", "-r", "-z", rev],
+        capture_output=True,
+        check=True,
+    ).stdout
+    blobs = []
+
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+
+        info, path = entry.split(b"\t", 1)
+        mode, obj_type, sha = info.split()
+
+        if obj_type == b"blob" and mode != GIT_SYMLINK_MODE:
+            blobs.append((os.fsdecode(path), sha))
+
+    return blobs
+
+
+def git_files(repo_path, lang, rev="HEAD"):
+    """
+    Yield SourceFile for each file of 'lang' in 'rev' of git repository at
+    'repo_path', which may be bare. Contents are read directly from the
+    object store, so no working tree is needed. Paths are reported as if
+    the repository was checked out at 'repo_path'.
+    """
+    blobs = [
+        (os.path.join(repo_path, path), sha)
+        for path, sha in list_git_blobs(repo_path, rev)
+        if is_source_file(lang, path)
+    ]
+
+    with GitObjectReader(repo_path) as reader:
+        for path, sha in blobs:
+            yield SourceFile(path, None, partial(reader.read, sha), hash=sha.decode())
+
+
+def read_tar_member(archive, member):
+    with archive.extractfile(member) as file:
+        return file.read()
+
+
+def archive_files(archive_path, lang):
+    """
+    Yield SourceFile for each file of 'lang' in tar (optionally compressed)
+    or zip archive at 'archive_path', without unpacking it. Tar archives are
+    read in a single sequential pass, so each file has to be loaded before
+    advancing to the next one. Paths are reported as if the archive was
+    unpacked into directory 'archive_path'.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_source_file(lang, info.filename):
+                    yield SourceFile(
+                        os.path.normpath(os.path.join(archive_path, info.filename)),
+                        info.file_size,
+                        partial(archive.read, info),
+                        time.mktime(info.date_time + (0, 0, -1)),
+                    )
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and is_source_file(lang, member.name):
+                    yield SourceFile(
+                        os.path.normpath(os.path.join(archive_path, member.name)),
+                        member.size,
+                        partial(read_tar_member, archive, member),
+                        member.mtime,
+                    )
+
+
+def prefetch(files, skip=None):
+    """
+    Yield SourceFile from 'files' with the next file being loaded in
+    background thread while the current one is processed. 'load' of yielded
+    files returns already loaded contents. Files for which 'skip' returns
+    True are not loaded upfront. 'files' is advanced only after the previous
+    load has finished, so sequential sources (tar streams) stay consistent.
+    """
+    files = iter(files)
+
+    def start(source_file):
+        if source_file is None or (skip is not None and skip(source_file)):
+            return None
+
+        return executor.submit(source_file.load)
+
+    with ThreadPoolExecutor(1) as executor:
+        current = next(files, None)
+        loading = start(current)
+
+        while current is not None:
+            content = loading.result() if loading is not None else None
+            following = next(files, None)
+            following_loading = start(following)
+
+            if loading is not None:
+                current = current._replace(load=lambda content=content: content)
+
+            yield current
+            current, loading = following, following_loading
+
+
+SOURCES = dict(
+    files=disk_files, tracked=tracked_files, git=git_files, archive=archive_files
+)
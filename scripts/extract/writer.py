@@ -0,0 +1,192 @@
+import time
+from queue import Empty
+
+from rich.console import Console
+
+from db.utils import *
+
+# Maximum number of messages (one per file) waiting for the writer, workers
+# block once it is full
+WRITER_QUEUE_SIZE = 256
+# Writer commits buffered functions after waiting this long for a message
+FLUSH_INTERVAL = 1.0
+# Writer reports its progress this often, in seconds
+STATS_INTERVAL = 30
+
+console = Console()
+
+
+class DatabaseWriter:
+    """
+    Applies messages of extraction workers to database (see extract_repo).
+    Files are identified by repository and path, so writing the same file
+    twice replaces its functions. Functions are copied in batches by
+    FunctionLoader and a file's stat is committed together with them.
+    """
+
+    def __init__(self, session, batch_size=COPY_BATCH_SIZE):
+        self.session = session
+        self.loader = FunctionLoader(session, batch_size)
+        self.files = 0
+
+    def handle(self, message):
+        """
+        Apply 'message'. If it fails, the uncommitted batch is rolled back
+        and dropped (its files have no stat yet, so they are extracted again
+        by the next run) and the message's file is quarantined, so a single
+        bad file does not stop the writer.
+        """
+        kind, *args = message
+
+        try:
+            getattr(self, kind)(*args)
+        except Exception as e:
+            self.session.rollback()
+            dropped = len(self.loader.files)
+            self.loader.rows, self.loader.files = [], []
+            console.print(
+                f"Writer failed to apply {kind} message, dropped {dropped} "
+                f"uncommitted files: {e!r}"
+            )
+
+            if kind == "file":
+                repo_id, path, (_, _, hash) = args[:3]
+                self.recover(repo_id, path, hash, e)
+            elif kind == "touch":
+                repo_id, path, _, _, hash = args
+                self.recover(repo_id, path, hash, e)
+
+    def recover(self, repo_id, path, hash, error):
+        try:
+            quarantine_file(
+                self.session, repo_id, path, hash, "error", f"writer: {error!r}"
+            )
+        except Exception as e:
+            self.session.rollback()
+            console.print(f"Writer failed to quarantine {path!r}: {e!r}")
+
+    def file(self, repo_id, path, stat, rows, skipped=None):
+        """
+        Replace functions of file at 'path' with 'rows' of (name, names,
+        file_name, lang, order) tuples and record its 'stat' (size, mtime,
+        hash) and 'skipped' reason.
+        """
+        file = get_file(self.session, repo_id, path)
+
+        if file is None:
+            file = add_file(self.session, repo_id, path, None, None, None, commit=False)
+        else:
+            self.loader.discard(file)
+            delete_file_functions(self.session, file, commit=False)
+
+        for name, names, file_name, lang, order in rows:
+            self.loader.add(name, names, repo_id, file_name, lang, order, file.id)
+
+        self.loader.complete_file(file, *stat, len(rows), skipped)
+        self.files += 1
+
+    def touch(self, repo_id, path, size, mtime, hash):
+        file = get_file(self.session, repo_id, path)
+
+        if file is not None:
+            update_file(self.session, file, size, mtime, hash, commit=False)
+
+    def retire(self, repo_id, paths):
+        self.flush()
+        files = [get_file(self.session, repo_id, path) for path in paths]
+        retire_files(self.session, [file for file in files if file is not None])
+
+    def quarantine(self, repo_id, path, hash, reason, detail):
+        self.flush()
+        quarantine_file(self.session, repo_id, path, hash, reason, detail)
+        self.retire(repo_id, [path])
+
+    def flush(self):
+        self.loader.flush()
+
+    @property
+    def rows(self):
+        return self.loader.written + len(self.loader.rows)
+
+
+class WriterClient:
+    """
+    Sends messages of extract_repo to writer process through 'queue', or
+    applies them with DatabaseWriter in the calling process if 'queue' is
+    None. 'blocked' counts seconds spent waiting for space in full queue.
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue
+        self.writer = None
+        self.blocked = 0
+
+        if queue is None:
+            self.writer = DatabaseWriter(init_local_session())
+
+    def send(self, *message):
+        if self.writer is not None:
+            self.writer.handle(message)
+            return
+
+        start = time.perf_counter()
+        self.queue.put(message)
+        self.blocked += time.perf_counter() - start
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.flush()
+            self.writer.session.close()
+            return
+
+        # Messages are written to the pipe by a background thread, wait for
+        # it so nothing is lost if the worker is terminated after returning.
+        # Queue can't be used by this process afterwards.
+        start = time.perf_counter()
+        self.queue.close()
+        self.queue.join_thread()
+        self.blocked += time.perf_counter() - start
+
+
+def run_writer(queue, queue_size=WRITER_QUEUE_SIZE):
+    """
+    Drain 'queue' into database until None is received. Periodically
+    reports queue depth and throughput: a mostly idle writer with an empty
+    queue waits for parsing, a busy writer with a full queue holds it back.
+    """
+    release_inherited_connections()
+    session = init_local_session()
+    writer = DatabaseWriter(session)
+    start = reported = time.perf_counter()
+    busy = 0
+
+    while True:
+        try:
+            message = queue.get(timeout=FLUSH_INTERVAL)
+        except Empty:
+            message = ("flush",)
+
+        if message is None:
+            break
+
+        handled = time.perf_counter()
+        writer.handle(message)
+        now = time.perf_counter()
+        busy += now - handled
+
+        if now - reported > STATS_INTERVAL:
+            console.print(
+                f"Writer: queue {queue.qsize()}/{queue_size}, "
+                f"{writer.files} files, {writer.rows / (now - start):,.0f} rows/s, "
+                f"busy {busy / (now - start):.0%}"
+            )
+            reported = now
+
+    writer.flush()
+    session.close()
+    elapsed = time.perf_counter() - start
+    console.print(
+        f"Writer: {writer.files} files, {writer.rows} functions in {elapsed:.1f}s, "
+        f"{writer.rows / max(busy, 1e-9):,.0f} rows/s while busy, "
+        f"busy {busy / max(elapsed, 1e-9):.0%}"
+    )
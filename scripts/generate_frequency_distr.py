@@ -18,7 +18,7 @@ def get_frequency_distribution():
 
     session = init_local_session()
 
-    for names in Function.get_all_names(session):
+    for names in Function.stream_all_names(session):
         names = names[0].split(" ")
         for name in names:
             soft_words = get_soft_words(name)
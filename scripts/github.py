@@ -0,0 +1,383 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import httpx
+from rich.console import Console
+
+API_URL = "https://api.github.com"
+MAX_CONNECTIONS = 8
+MAX_RETRIES = 5
+CACHE_PATH = "build/github_cache.sqlite"
+CACHE_MAX_MB = 512
+CACHE_TTL = 24 * 60 * 60
+# Headers which describe encoding of the original transfer, not cached body
+SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+console = Console()
+
+
+class RateLimiter:
+    """
+    Schedules requests according to Github's rate limit headers. Requests are
+    sent as fast as the remaining budget allows and are held back only when
+    the budget is exhausted (until 'X-RateLimit-Reset') or when the server
+    asks to back off with 'Retry-After'.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.resume_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def update(self, headers):
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+
+        if remaining is None or reset is None:
+            return
+
+        remaining, reset = int(remaining), float(reset)
+
+        if "x-ratelimit-limit" in headers:
+            self.limit = int(headers["x-ratelimit-limit"])
+
+        # Response from already expired window, budget has been renewed since.
+        if reset + 1 < time.time() or (self.reset is not None and reset < self.reset):
+            return
+
+        # Within the same window keep the lower value, since our own count
+        # already accounts for requests which are still in flight.
+        if self.remaining is not None and self.reset in (None, reset):
+            self.remaining = min(self.remaining, remaining)
+        else:
+            self.remaining = remaining
+
+        self.reset = reset
+
+    def retry_after(self, headers):
+        """
+        Return number of seconds to wait before retrying a rejected request,
+        or None if response does not indicate rate limiting.
+        """
+        retry_after = headers.get("retry-after")
+
+        if retry_after is not None:
+            return float(retry_after)
+
+        if headers.get("x-ratelimit-remaining") == "0":
+            reset = headers.get("x-ratelimit-reset")
+            return max(float(reset) - time.time(), 0) + 1 if reset else 60
+
+        return None
+
+    def refund(self):
+        """
+        Return budget of a request which was not counted by the server.
+        """
+        if self.remaining is not None:
+            self.remaining += 1
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.time() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.time()
+                delay = self.resume_at - now
+
+                if self.remaining is not None and self.remaining <= 0:
+                    if self.reset is not None and self.reset + 1 <= now:
+                        # Window is over, full budget is available again.
+                        self.remaining, self.reset = self.limit, None
+                    else:
+                        resume_at = self.reset + 1 if self.reset else now + 1
+                        delay = max(delay, resume_at - now)
+
+                if delay <= 0:
+                    break
+
+                console.print(f"Rate limit reached, waiting {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+            if self.remaining is not None:
+                self.remaining -= 1
+
+
+class ResponseCache:
+    """
+    Persistent cache of API responses stored in SQLite database, keyed by
+    method, URL, query parameters and request body. Entries younger than
+    'ttl' seconds are replayed without contacting the server. Older entries
+    with ETag or Last-Modified are revalidated with a conditional request,
+    304 responses do not count against Github's rate limit. Least recently
+    used entries are evicted once cached bodies exceed 'max_mb' megabytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_mb=CACHE_MAX_MB, ttl=CACHE_TTL):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                size INTEGER,
+                stored_at REAL,
+                accessed_at REAL
+            )
+            """
+        )
+        self.max_size = max_mb * 2**20
+        self.ttl = ttl
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_env():
+        """
+        Create cache configured by GITHUB_CACHE_PATH, GITHUB_CACHE_MAX_MB and
+        GITHUB_CACHE_TTL environment variables. Returns None if
+        GITHUB_CACHE_PATH is set to an empty string.
+        """
+        path = os.getenv("GITHUB_CACHE_PATH", CACHE_PATH)
+
+        if not path:
+            return None
+
+        return ResponseCache(
+            path,
+            float(os.getenv("GITHUB_CACHE_MAX_MB", CACHE_MAX_MB)),
+            float(os.getenv("GITHUB_CACHE_TTL", CACHE_TTL)),
+        )
+
+    @staticmethod
+    def key(method, url, params=None, body=None):
+        params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        payload = json.dumps([method, str(url), params, body], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Return cached entry as (response, is_fresh) tuple, or None.
+        """
+        row = self.db.execute(
+            "SELECT status, headers, body, stored_at FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        status, headers, body, stored_at = row
+        self.db.execute(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        response = httpx.Response(status, headers=json.loads(headers), content=body)
+        return response, time.time() - stored_at < self.ttl
+
+    def put(self, key, response):
+        body = response.content
+        headers = [
+            (name, value)
+            for name, value in response.headers.multi_items()
+            if name.lower() not in SKIPPED_HEADERS
+        ]
+        old = self.db.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                response.status_code,
+                json.dumps(headers),
+                body,
+                len(body),
+                time.time(),
+                time.time(),
+            ),
+        )
+        self.size += len(body) - (old[0] if old else 0)
+        self.evict()
+        self.db.commit()
+
+    def touch(self, key):
+        """
+        Mark entry as fresh after successful revalidation.
+        """
+        self.revalidated += 1
+        self.db.execute(
+            "UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), key)
+        )
+        self.db.commit()
+
+    def evict(self):
+        while self.size > self.max_size:
+            rows = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+
+            if not rows:
+                break
+
+            for key, size in rows:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+
+                if self.size <= self.max_size:
+                    break
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    @staticmethod
+    def conditional_headers(response):
+        headers = {}
+
+        if "etag" in response.headers:
+            headers["If-None-Match"] = response.headers["etag"]
+
+        if "last-modified" in response.headers:
+            headers["If-Modified-Since"] = response.headers["last-modified"]
+
+        return headers
+
+
+class GithubClient:
+    """
+    Asynchronous Github API client using single pool of keep-alive
+    connections. Use as async context manager:
+
+        async with GithubClient() as client:
+            response = await client.get("/repos/owner/name")
+
+    If 'cache' (ResponseCache) is given, successful responses are cached and
+    replayed or revalidated on subsequent requests.
+    """
+
+    def __init__(self, token=None, base_url=None, max_connections=None, cache=None):
+        self.token = token or os.getenv("GITHUB_TOKEN", None)
+        self.base_url = base_url or os.getenv("GITHUB_API_URL", API_URL)
+        self.max_connections = max_connections or int(
+            os.getenv("GITHUB_MAX_CONNECTIONS", MAX_CONNECTIONS)
+        )
+        self.limiter = RateLimiter()
+        self.cache = cache
+        self.client = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        headers = {"Accept": "application/vnd.github+json"}
+
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=httpx.Timeout(30.0, pool=None),
+        )
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+        if self.cache is not None:
+            console.print(
+                f"Response cache: {self.cache.hits} fresh hits, "
+                f"{self.cache.revalidated} revalidated, {self.cache.misses} misses"
+            )
+            self.cache.close()
+
+    async def request(self, method, url, params=None, json=None, headers=None):
+        """
+        Send request, replaying or revalidating cached response if available.
+        """
+        if self.cache is None:
+            return await self._send(method, url, params, json, headers)
+
+        key = self.cache.key(method, f"{self.base_url}{url}", params, json)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            cached, is_fresh = cached
+
+            if is_fresh:
+                self.cache.hits += 1
+                return cached
+
+            headers = dict(headers or {}, **self.cache.conditional_headers(cached))
+
+        response = await self._send(method, url, params, json, headers)
+
+        if response.status_code == 304 and cached is not None:
+            self.limiter.refund()
+            self.cache.touch(key)
+            return cached
+
+        if response.status_code == 200:
+            self.cache.put(key, response)
+
+        return response
+
+    async def _send(self, method, url, params, json, headers):
+        """
+        Send request, waiting for rate limit budget and retrying requests
+        rejected due to rate limiting or server errors.
+        """
+        kwargs = dict(params=params, json=json, headers=headers)
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire()
+
+            async with self.semaphore:
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    if attempt == MAX_RETRIES:
+                        raise
+                    console.print(f"Request to {url} failed: {e}, retrying")
+                    await asyncio.sleep(2**attempt)
+                    continue
+
+            self.limiter.update(response.headers)
+
+            if response.status_code in (403, 429):
+                delay = self.limiter.retry_after(response.headers)
+
+                if delay is not None and attempt < MAX_RETRIES:
+                    console.print(f"Rate limited on {url}, retrying in {delay:.1f}s")
+                    self.limiter.pause(delay)
+                    continue
+
+            elif response.status_code >= 500 and attempt < MAX_RETRIES:
+                await asyncio.sleep(2**attempt)
+                continue
+
+            return response
+
+    async def get(self, url, params=None, headers=None):
+        return await self.request("GET", url, params=params, headers=headers)
+
+    async def post(self, url, json=None, headers=None):
+        return await self.request("POST", url, json=json, headers=headers)
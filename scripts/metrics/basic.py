@@ -15,9 +15,10 @@ from Levenshtein import distance as levenshtein_distance
 from nltk.tokenize import RegexpTokenizer
 from rich.console import Console
 
-from db.models import Function, Repo
-from db.utils import (commit, get_functions_for_repo, get_repos,
-                      init_local_session)
+from db.columns import iter_functions
+from db.models import Repo
+from db.utils import (MetricWriter, commit, get_functions_for_repo,
+                      get_repos, init_local_session)
 
 from .cc import get_conciseness_and_consistency
 from .context_coverage import get_context_coverage
@@ -76,35 +77,41 @@ def get_median_levenshtein_distance(word_pairs):
 
 def calculate_context_coverage():
     session = init_local_session()
+    writer = MetricWriter()
     count = 0
 
     for repo in Repo.all(session, selected=True):
         console.print(f"Calculating context coverage for {repo.name}", style="red")
         all_names = set()
         all_function_bodies = []
-        functions = Function.filter_by(session, repo_id=repo.id)
+        functions = []
+        total = 0
+        count = 0
 
-        functions = [
-            function
-            for function in functions
-            if (function.name and "test" not in function.name)
-        ]
+        columns = ["id", "name", "names", "context_coverage"]
+
+        # Only first 2000 functions are kept, the rest are just counted
+        for function_id, name, names, context_coverage in iter_functions(
+            session, columns, repo_id=repo.id
+        ):
+            if not name or "test" in name:
+                continue
+
+            total += 1
+            count += context_coverage is not None
+
+            if len(functions) < 2000:
+                functions.append((function_id, name, names.split(" ")))
 
-        count = sum(
-            1 for function in functions if function.context_coverage is not None
-        )
         console.print(
-            f"Found {len(functions)} functions and {count} functions with context coverage",
+            f"Found {total} functions and {count} functions with context coverage",
             style="red",
         )
 
-        if count >= 2000 or count >= len(functions):
+        if count >= 2000 or count >= total:
             continue
 
-        functions = functions[:2000]
-
-        for function in functions:
-            names = function.names.split(" ")
+        for _, _, names in functions:
             all_function_bodies.append(names)
             all_names.update(names[:20])
 
@@ -115,11 +122,11 @@ def calculate_context_coverage():
 
         values = get_context_coverage(all_function_bodies, all_names)
 
-        for function in functions:
+        for function_id, function_name, names in functions:
             console.print(
-                f"Calculating context coverage for {function.name}", style="yellow"
+                f"Calculating context coverage for {function_name}", style="yellow"
             )
-            names = function.names.split(" ")[:20]
+            names = names[:20]
             scores = []
 
             for name, value in values.items():
@@ -127,8 +134,13 @@ def calculate_context_coverage():
                     scores.append(value)
 
             if len(scores) > 0:
-                function.context_coverage = float(median(scores))
-                session.commit()
+                writer.add(function_id, dict(context_coverage=float(median(scores))))
+
+    writer.close()
+    console.print(
+        f"Wrote context coverage of {writer.written} functions, "
+        f"{writer.rate:,.0f} rows/s"
+    )
 
 
 def get_duplicate_percentage(names):
@@ -144,18 +156,23 @@ def get_duplicate_percentage(names):
 
 def calculate_basic_metrics_for_repo(repo_id):
     session = init_local_session()
+    writer = MetricWriter()
     abbreviations = load_abbreviations("build/abbreviations.csv")
     count = 0
 
-    for function in Function.filter_by(session, repo_id=repo_id):
-        names = function.names.split(" ")
+    for function_id, names in iter_functions(
+        session, ["id", "names"], repo_id=repo_id
+    ):
+        names = names.split(" ")
         metrics = get_basic_metrics(names, abbreviations)
         count += 1
+        writer.add(function_id, metrics)
 
-        for key, value in metrics.items():
-            setattr(function, key, value)
-
-        session.commit()
+    writer.close()
+    console.print(
+        f"Wrote basic metrics of {writer.written} functions, "
+        f"{writer.rate:,.0f} rows/s"
+    )
 
 
 def calculate_basic_metrics():
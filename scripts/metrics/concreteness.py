@@ -13,8 +13,9 @@ from nltk.stem import LancasterStemmer, PorterStemmer, SnowballStemmer
 from rich.console import Console
 from scipy.spatial.distance import cosine
 
-from db.models import Function, Repo
-from db.utils import init_local_session
+from db.columns import iter_functions
+from db.models import Repo
+from db.utils import MetricWriter, init_local_session
 
 
 NUM_PROCESSES = 4
@@ -154,15 +155,16 @@ def get_multigram_concreteness(word):
 
 def process(lang):
     session = init_local_session()
+    writer = MetricWriter()
 
     for repo in Repo.all(session, selected=True):
-        functions = Function.filter_by(session, repo_id=repo.id)
+        # Only functions without concreteness yet (see db/migrations.py)
+        functions = iter_functions(
+            session, ["id", "names"], repo_id=repo.id, median_word_concreteness=None
+        )
 
-        for function in functions:
-            if function.median_word_concreteness is not None:
-                continue
-
-            names = function.names.split(" ")
+        for function_id, names in functions:
+            names = names.split(" ")
 
             values = [get_multigram_concreteness(name) for name in names]
             values = [v for v in values if v is not None]
@@ -172,9 +174,13 @@ def process(lang):
 
             median_conc = statistics.median(values)
             console.print(f"Median concreteness: {median_conc}")
-            function.median_word_concreteness = median_conc
-            session.commit()
+            writer.add(function_id, dict(median_word_concreteness=median_conc))
 
+    writer.close()
+    console.print(
+        f"Wrote concreteness of {writer.written} functions, "
+        f"{writer.rate:,.0f} rows/s"
+    )
     session.close()
 
 
@@ -13,8 +13,9 @@ from matplotlib.ticker import ScalarFormatter
 from rich.console import Console
 from scipy.spatial.distance import cosine
 
+from db.columns import iter_functions
 from db.models import Repo
-from db.utils import get_functions_for_repo, init_local_session
+from db.utils import MetricWriter, init_local_session
 from scripts.lang import LANGS
 
 console = Console()
@@ -25,16 +26,20 @@ MODEL = f"build/models/{MODEL_NAME}.bin"
 
 def calc_median_dist(session, repos, model):
     medians = []
+    writer = MetricWriter()
+    columns = ["id", "name", "names", "median_id_semantic_similarity"]
 
     for repo in repos:
-        for function in get_functions_for_repo(repo.id, session):
-            console.print(f"{function.name}")
+        functions = iter_functions(session, columns, repo_id=repo.id)
 
-            if function.median_id_semantic_similarity is not None:
-                medians.append(function.median_id_semantic_similarity)
+        for function_id, function_name, names, similarity in functions:
+            console.print(f"{function_name}")
+
+            if similarity is not None:
+                medians.append(similarity)
                 continue
 
-            names = function.names.split(" ")
+            names = names.split(" ")
 
             if len(names) < 2:
                 continue
@@ -66,15 +71,19 @@ def calc_median_dist(session, repos, model):
             median = statistics.median(cosines)
 
             if median != None:
-                function.median_id_semantic_similarity = median
-                session.commit()
-                console.print(f"{function.name} = {median}")
+                writer.add(function_id, dict(median_id_semantic_similarity=median))
+                console.print(f"{function_name} = {median}")
                 medians.append(median)
             else:
                 console.print(
-                    f"Median is None for {function.name}, num names: {len(names)}"
+                    f"Median is None for {function_name}, num names: {len(names)}"
                 )
 
+    writer.close()
+    console.print(
+        f"Wrote similarity of {writer.written} functions, {writer.rate:,.0f} rows/s"
+    )
+
     return medians
 
 
@@ -4,36 +4,39 @@ from statistics import median
 
 from rich.console import Console
 
+from db.columns import iter_functions
 from db.models import Repo
-from db.utils import get_functions_for_repo, init_local_session
+from db.utils import MetricWriter, init_local_session
 
 console = Console()
 
 
 def calculate_term_entropy():
     session = init_local_session()
+    writer = MetricWriter()
 
     for repo in Repo.all(session, selected=True):
         console.print(f"Calculating term entropy for repo {repo.id}")
-        functions = get_functions_for_repo(repo.id, session)
+        all_have_term_entropy = True
+        identifier_entity_matrix = defaultdict(lambda: defaultdict(int))
+
+        columns = ["id", "names", "term_entropy"]
+
+        for function_id, names, term_entropy in iter_functions(
+            session, columns, repo_id=repo.id
+        ):
+            all_have_term_entropy &= term_entropy is not None
+            identifiers = names.split()
+
+            for identifier in identifiers:
+                identifier_entity_matrix[identifier][function_id] += 1
 
-        all_have_term_entropy = all(
-            function.term_entropy is not None for function in functions
-        )
         if all_have_term_entropy:
             console.print(
                 f"All functions in repo {repo.id} already have term_entropy calculated. Skipping..."
             )
             continue
 
-        identifier_entity_matrix = defaultdict(lambda: defaultdict(int))
-
-        for function in functions:
-            identifiers = function.names.split()
-
-            for identifier in identifiers:
-                identifier_entity_matrix[identifier][function.id] += 1
-
         identifier_entropy_results = {}
 
         for identifier, entities in identifier_entity_matrix.items():
@@ -52,21 +55,29 @@ def calculate_term_entropy():
 
             identifier_entropy_results[identifier] = entropy
 
-        for function in functions:
-            names = function.names.split()
+        columns = ["id", "name", "names"]
+
+        for function_id, function_name, names in iter_functions(
+            session, columns, repo_id=repo.id
+        ):
+            names = names.split()
 
             entropies = []
             for name in names:
                 entropies.append(identifier_entropy_results[name])
 
             if len(entropies) > 0:
-                function.term_entropy = median(entropies)
-                session.add(function)
+                writer.add(function_id, dict(term_entropy=median(entropies)))
                 try:
                     console.print(
-                        f"Median term entropy for {function.name}: {median(entropies)}"
+                        f"Median term entropy for {function_name}: {median(entropies)}"
                     )
                 except:
                     pass
 
-        session.commit()
+        writer.flush()
+
+    writer.close()
+    console.print(
+        f"Wrote term entropy of {writer.written} functions, {writer.rate:,.0f} rows/s"
+    )
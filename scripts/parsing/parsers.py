@@ -1,7 +1,9 @@
 import argparse
+import math
 import os
 import random
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
 
 from rich.console import Console
 from tree_sitter import Language, Parser
@@ -14,6 +16,14 @@ CLJ_KEYWORDS = [b"defn", b"defn-", b"def", b"defmacro", b"defmethod"]
 console = Console()
 
 
+# Function yielded by 'stream' with the file it was found in and its position
+FunctionRecord = namedtuple("FunctionRecord", ["name", "identifiers", "file", "order"])
+
+
+class ParseTimeout(Exception):
+    pass
+
+
 def unique_id():
     count = 1
     while True:
@@ -21,255 +31,576 @@ def unique_id():
         count += 1
 
 
+def load_file(input_file):
+    """
+    Return contents of 'input_file' as bytes, read with a single call.
+    Tree-sitter parses bytes in any encoding (invalid UTF-8 is tolerated),
+    so contents are not decoded.
+    """
+    with open(input_file, "rb") as file:
+        return file.read()
+
+
 def extract(parser, input_file, extract_fn):
-    if not os.path.exists(input_file):
-        raise FileNotFoundError(f"file not found: {input_file}")
-
-    content = None
-    try:
-        with open(input_file, "r") as file:
-            content = file.read()
-            content = bytes(content, "utf-8")
-    except:
-        with open(input_file, "rb") as file:
-            content = file.read()
-
-    tree = parser.parse(content)
+    return extract_content(parser, load_file(input_file), extract_fn)
+
+
+def extract_content(parser, content, extract_fn):
+    """
+    Return dict of identifiers of all functions in 'content' by function
+    name. Functions sharing a name are merged.
+    """
+    return merge(iter_functions(parser.parse(content).root_node, extract_fn))
+
+
+def stream(parser, content, extract_fn, file=None, timeout=None):
+    """
+    Yield FunctionRecord for each function in 'content' as soon as the walk
+    leaves it, so only identifiers of functions which are still open are
+    held in memory. Nested functions are yielded before their enclosing
+    function, 'order' counts functions in the order they are yielded.
+    Functions sharing a name are yielded separately.
+
+    If 'timeout' (seconds) is given, ParseTimeout is raised when parsing
+    takes longer (tree-sitter stops the parse) or when extraction is still
+    running once it has passed (checked between functions).
+    """
+    if timeout is None:
+        tree = parser.parse(content)
+    else:
+        deadline = time.monotonic() + timeout
+        parser.set_timeout_micros(int(timeout * 1e6))
+
+        try:
+            tree = parser.parse(content)
+        except ValueError:
+            # Stopped parse would be resumed by the next call, start afresh
+            parser.reset()
+            raise ParseTimeout(f"parsing {file} took longer than {timeout:.1f}s")
+
+    functions = iter_functions(tree.root_node, extract_fn)
+
+    for order, (name, identifiers) in enumerate(functions, start=1):
+        if timeout is not None and time.monotonic() > deadline:
+            raise ParseTimeout(f"extracting {file} took longer than {timeout:.1f}s")
+
+        yield FunctionRecord(name, identifiers, file, order)
+
+
+def iter_functions(root, extract_fn):
+    """
+    Yield (name, identifiers) tuples of functions in tree under 'root'.
+    """
+    if isinstance(extract_fn, QueryExtractor):
+        return extract_fn(root, unique_id())
+
+    return walk(root, unique_id(), extract_fn)
+
+
+def merge(functions):
     acc = defaultdict(list)
-    extract_fn(tree.root_node, acc, unique_id())
+
+    for name, identifiers in functions:
+        acc[name].extend(identifiers)
+
     return acc
 
 
-def extract_clojure(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "list_lit" and node.children[1].text in CLJ_KEYWORDS
+def get_extractor(lang, engine="walk"):
+    """
+    Return extractor of 'lang' to pass to 'extract_content'. 'engine' is
+    either 'walk' (extract_<lang> visited by 'walk') or 'query' (query_<lang>
+    matched by compiled tree-sitter Query).
+    """
+    prefix = dict(walk="extract", query="query")[engine]
+    return globals()[f"{prefix}_{lang}"]
+
+
+def starts_function(state, outer_state):
+    """
+    Return True if node whose children get 'state' opens a new function
+    scope inside scope of 'outer_state'. Both are (in_fun, name) tuples.
+    """
+    return state[0] and (not outer_state[0] or state[1] != outer_state[1])
+
+
+def walk(root, ids, visit):
+    """
+    Walk tree under 'root' depth-first in document order with a TreeCursor,
+    without recursion, and yield (name, identifiers) of each function once
+    its subtree has been left. 'visit(node, parent, acc, ids, in_fun, name)'
+    is called for each node with the state of its parent, appends
+    identifiers to 'acc' and returns (in_fun, name) state passed down to the
+    node's children. If 'visit' is decorated with 'visits', it is called
+    only for nodes of listed types and other nodes pass their parent's state
+    through.
+    """
+    node_types = getattr(visit, "node_types", None)
+    acc = defaultdict(list)
+    cursor = root.walk()
+    # (node, in_fun, name) of each ancestor of the cursor's node
+    stack = [(None, False, None)]
 
-        if is_defn:
-            name = f'{str(node.children[2].text, encoding="utf-8")}#{next(ids)}'
+    while True:
+        node = cursor.node
+        parent, in_fun, name = stack[-1]
 
-        if (
-            in_fun
-            and node.type in ["sym_name", "sym_ns"]
-            and node.text not in CLJ_KEYWORDS
-        ):
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
+        if node_types is None or node.type in node_types:
+            in_fun, name = visit(node, parent, acc, ids, in_fun, name)
 
-    for child in node.children:
-        extract_clojure(child, acc, ids, in_fun or is_defn, name)
+        if cursor.goto_first_child():
+            stack.append((node, in_fun, name))
+            continue
 
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                # Identifiers of functions without a subtree of their own
+                yield from acc.items()
+                return
 
-def extract_haskell(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "function" and not in_fun
+            _, in_fun, name = stack.pop()
 
-        if is_defn:
-            name = f'{str(node.children[0].text, encoding="utf-8")}#{next(ids)}'
+            if name in acc and starts_function((in_fun, name), stack[-1][1:]):
+                yield name, acc.pop(name)
 
-        if in_fun and node.type in ["variable"]:
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
 
-    for child in node.children:
-        extract_haskell(child, acc, ids, in_fun or is_defn, name)
+def visits(*node_types):
+    """
+    Declare types of nodes an extractor needs to see, see 'walk'.
+    """
 
+    def decorate(extract_fn):
+        extract_fn.node_types = set(node_types)
+        return extract_fn
 
-def extract_elixir(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "call" and node.children[0].text in [b"def", b"defp"]
+    return decorate
 
-        if is_defn:
-            f_name = str(
-                node.children[1].children[0].children[0].text, encoding="utf-8"
-            )
 
-            if "(" in f_name:
-                f_name = f_name.split("(")[0]
+def child(node, *indices):
+    """
+    Return descendant of 'node' reached by following child 'indices', or None
+    if there is no such node. Node.child does not check bounds.
+    """
+    for index in indices:
+        if node is None or index >= node.child_count:
+            return None
 
-            name = f"{f_name}#{next(ids)}"
+        node = node.child(index)
 
-        if in_fun and node.type == "identifier" and node.text not in EX_KEYWORDS:
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
-
-    for child in node.children:
-        extract_elixir(child, acc, ids, in_fun or is_defn, name)
-
-
-def extract_erlang(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "fun_decl"
-
-        if is_defn:
-            name = f'{str(node.children[0].children[0].text, encoding="utf-8")}#{next(ids)}'
-
-        if in_fun and node.type in ["atom", "var"]:
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
-
-    for child in node.children:
-        extract_erlang(child, acc, ids, in_fun or is_defn, name)
-
-
-def extract_python(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "function_definition"
-
-        if is_defn:
-            name = f'{str(node.children[1].text, encoding="utf-8")}#{next(ids)}'
-
-        if in_fun and node.type == "identifier" and node.parent.type != "type":
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
-
-    for child in node.children:
-        extract_python(child, acc, ids, in_fun or is_defn, name)
-
-
-def extract_javascript(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = (
-            node.type
-            in [
-                "function",
-                "function_declaration",
-                "arrow_function",
-                "method_definition",
-                "generator_function_declaration",
-            ]
-            and not in_fun
-        )
-
-        if is_defn:
-            if (
-                node.type in ["function", "arrow_function"]
-                and node.parent.type == "variable_declarator"
-            ):
-                f_name = str(node.parent.children[0].text, encoding="utf-8")
-                name = f"{f_name}#{next(ids)}"
-                acc[name].append(f_name)
-            elif node.type == "function_declaration":
-                if node.children[0].type == "async":
-                    name = f'{str(node.children[2].text, encoding="utf-8")}#{next(ids)}'
-                else:
-                    name = f'{str(node.children[1].text, encoding="utf-8")}#{next(ids)}'
-            elif node.type == "method_definition":
-                f_name = str(node.children[0].text, encoding="utf-8")
-                name = f"{f_name}#{next(ids)}"
-                acc[name].append(f_name)
-            elif node.type == "generator_function_declaration":
-                name = f'{str(node.children[2].text, encoding="utf-8")}#{next(ids)}'
-
-        if in_fun and node.type == "identifier":
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
-
-    for child in node.children:
-        extract_javascript(child, acc, ids, in_fun or is_defn, name)
-
-
-def extract_c(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "function_definition"
-
-        if is_defn:
-            decl = find_child(node.children, "function_declarator")
-            if decl:
-                name = f'{str(decl.children[0].text, encoding="utf-8")}'
-            else:
-                is_defn = False
-
-        if in_fun and node.type == "identifier":
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
-
-    for child in node.children:
-        try:
-            extract_c(child, acc, ids, in_fun or is_defn, name)
-        except:
-            pass
-
-
-def find_child(children, node_type, direct=False):
-    for child in children:
-        if child.type == node_type:
-            return child
-        elif not direct:
-            found = find_child(child.children, node_type)
-
-            if found:
-                return found
-
-
-def extract_fortran(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = (
-            node.type == "function"
-            and node.children
-            and node.children[0].type == "function_statement"
-        )
-        is_defn = is_defn or (
-            node.type == "subroutine"
-            and node.children
-            and node.children[0].type == "subroutine_statement"
-        )
-
-        if is_defn:
-            name_node = find_child(node.children[0].children, "name", True)
-            f_name = str(name_node.text, encoding="utf-8")
+    return node
+
+
+def text(node):
+    # Files are not required to be UTF-8, undecodable bytes are replaced
+    return str(node.text, encoding="utf-8", errors="replace")
+
+
+@visits("list_lit", "sym_name", "sym_ns")
+def extract_clojure(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "list_lit" and child(node, 1) is not None
+    is_defn = is_defn and child(node, 1).text in CLJ_KEYWORDS
+
+    if is_defn and child(node, 2) is not None:
+        name = f"{text(child(node, 2))}#{next(ids)}"
+
+    if in_fun and node_type in ["sym_name", "sym_ns"] and node.text not in CLJ_KEYWORDS:
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+@visits("function", "variable")
+def extract_haskell(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "function" and not in_fun
+
+    if is_defn and node.child_count:
+        name = f"{text(node.child(0))}#{next(ids)}"
+
+    if in_fun and node_type == "variable":
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+@visits("call", "identifier")
+def extract_elixir(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "call" and node.child_count > 0
+    is_defn = is_defn and node.child(0).text in [b"def", b"defp"]
+
+    if is_defn:
+        name_node = child(node, 1, 0, 0)
+
+        if name_node is not None:
+            name = f'{text(name_node).split("(")[0]}#{next(ids)}'
+
+    if in_fun and node_type == "identifier" and node.text not in EX_KEYWORDS:
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+@visits("fun_decl", "atom", "var")
+def extract_erlang(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "fun_decl"
+
+    if is_defn:
+        name_node = child(node, 0, 0)
+
+        if name_node is not None:
+            name = f"{text(name_node)}#{next(ids)}"
+
+    if in_fun and node_type in ["atom", "var"]:
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+@visits("function_definition", "identifier")
+def extract_python(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "function_definition"
+
+    if is_defn and node.child_count > 1:
+        name = f"{text(node.child(1))}#{next(ids)}"
+
+    if in_fun and node_type == "identifier" and parent.type != "type":
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+JS_FUNCTIONS = [
+    "function",
+    "function_declaration",
+    "arrow_function",
+    "method_definition",
+    "generator_function_declaration",
+]
+
+
+@visits(*JS_FUNCTIONS, "identifier")
+def extract_javascript(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type in JS_FUNCTIONS and not in_fun
+
+    if is_defn:
+        if (
+            node_type in ["function", "arrow_function"]
+            and parent.type == "variable_declarator"
+        ):
+            f_name = text(parent.child(0))
             name = f"{f_name}#{next(ids)}"
             acc[name].append(f_name)
+        elif node_type == "function_declaration":
+            is_async = child(node, 0) is not None and node.child(0).type == "async"
+            name_node = child(node, 2 if is_async else 1)
+
+            if name_node is not None:
+                name = f"{text(name_node)}#{next(ids)}"
+        elif node_type == "method_definition" and node.child_count:
+            f_name = text(node.child(0))
+            name = f"{f_name}#{next(ids)}"
+            acc[name].append(f_name)
+        elif node_type == "generator_function_declaration" and child(node, 2):
+            name = f"{text(node.child(2))}#{next(ids)}"
+
+    if in_fun and node_type == "identifier":
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
 
-        if in_fun and node.type in ["identifier"]:
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
+@visits("function_definition", "identifier")
+def extract_c(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "function_definition"
 
-    for child in node.children:
-        extract_fortran(child, acc, ids, in_fun or is_defn, name)
+    if is_defn:
+        decl = find_function_declarator(node)
 
+        if decl is not None and decl.child_count:
+            name = text(decl.child(0))
+        else:
+            is_defn = False
+
+    if in_fun and node_type == "identifier":
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+# Declarators which wrap another declarator, e.g. '*f(void)' or '(f)(void)'
+C_WRAPPING_DECLARATORS = [
+    "pointer_declarator",
+    "parenthesized_declarator",
+    "attributed_declarator",
+]
+
+
+def find_function_declarator(node):
+    """
+    Return function_declarator of C function_definition 'node' by following
+    its chain of declarators, or None if the definition has none (e.g. when
+    its header is a macro). Only the header is inspected, never the body.
+    """
+    decl = node.child_by_field_name("declarator")
+
+    while decl is not None and decl.type in C_WRAPPING_DECLARATORS:
+        inner = decl.child_by_field_name("declarator")
+
+        # Parenthesized declarator has no field names
+        if inner is None and decl.named_child_count:
+            inner = decl.named_child(0)
+
+        decl = inner
+
+    if decl is not None and decl.type == "function_declarator":
+        return decl
+
+    return None
+
+
+def find_child(node, node_type):
+    """
+    Return first direct child of 'node' of 'node_type', or None.
+    """
+    cursor = node.walk()
+    found = cursor.goto_first_child()
+
+    while found and cursor.node.type != node_type:
+        found = cursor.goto_next_sibling()
+
+    return cursor.node if found else None
+
+
+@visits("function", "subroutine", "identifier")
+def extract_fortran(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    statement = child(node, 0)
+    is_defn = (
+        node_type == "function"
+        and statement is not None
+        and statement.type == "function_statement"
+    )
+    is_defn = is_defn or (
+        node_type == "subroutine"
+        and statement is not None
+        and statement.type == "subroutine_statement"
+    )
+
+    if is_defn:
+        name_node = statement.child_by_field_name("name")
+
+        if name_node is not None:
+            f_name = text(name_node)
+            name = f"{f_name}#{next(ids)}"
+            acc[name].append(f_name)
 
-def extract_java(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = node.type == "method_declaration"
+    if in_fun and node_type == "identifier":
+        acc[name].append(text(node))
 
-        if is_defn:
-            name_node = find_child(node.children, "identifier", True)
-            name = f'{str(name_node.text, encoding="utf-8")}#{next(ids)}'
+    return in_fun or is_defn, name
 
-        if in_fun and node.type == "identifier":
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
 
-    for child in node.children:
-        extract_java(child, acc, ids, in_fun or is_defn, name)
+@visits("method_declaration", "identifier")
+def extract_java(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = node_type == "method_declaration"
 
+    if is_defn:
+        name_node = find_child(node, "identifier")
 
-def extract_ocaml(node, acc, ids, in_fun=False, name=None):
-    try:
-        is_defn = (
-            not in_fun
-            and node.type == "let_binding"
-            and find_child(node.children, "parameter", True)
-        )
+        if name_node is not None:
+            name = f"{text(name_node)}#{next(ids)}"
 
-        if is_defn:
-            f_name = str(node.children[0].text, encoding="utf-8")
-            name = f_name  # f'{f_name}#{next(ids)}'
-            # acc[name].append(f_name)
+    if in_fun and node_type == "identifier":
+        acc[name].append(text(node))
 
-        if in_fun and node.type == "value_name":
-            acc[name].append(str(node.text, encoding="utf-8"))
-    except:
-        pass
+    return in_fun or is_defn, name
 
-    for child in node.children:
-        extract_ocaml(child, acc, ids, in_fun or is_defn, name)
+
+@visits("let_binding", "value_name")
+def extract_ocaml(node, parent, acc, ids, in_fun, name):
+    node_type = node.type
+    is_defn = (
+        not in_fun
+        and node_type == "let_binding"
+        and find_child(node, "parameter") is not None
+    )
+
+    if is_defn:
+        name = text(node.child(0))
+
+    if in_fun and node_type == "value_name":
+        acc[name].append(text(node))
+
+    return in_fun or is_defn, name
+
+
+class QueryExtractor:
+    """
+    Extracts functions with a compiled tree-sitter Query, so nodes are
+    matched in C and only captures reach Python. Nodes captured as @function
+    are passed to 'visit' (the walker's extract_<lang>), which decides if
+    they define a function and how it is named. Nodes captured as
+    @identifier are appended to the innermost enclosing function, unless
+    the same node was captured as @skip by an earlier pattern.
+    """
+
+    def __init__(self, lang, source, visit):
+        self.lang = lang
+        self.source = source
+        self.visit = visit
+        self.query = None
+
+    def __call__(self, root, ids):
+        """
+        Yield (name, identifiers) of each function in tree under 'root', see
+        'walk'.
+        """
+        if self.query is None:
+            language = Language("build/parser_bindings.so", self.lang)
+            self.query = language.query(self.source)
+
+        acc = defaultdict(list)
+        # State of the innermost enclosing @function node, which ends at
+        # 'end', and states of the outer ones.
+        end, in_fun, name = math.inf, False, None
+        stack = []
+        skipped = None
+
+        for node, capture in self.query.captures(root):
+            start = node.start_byte
+
+            while start >= end:
+                outer = stack.pop()
+
+                if name in acc and starts_function((in_fun, name), outer[1:]):
+                    yield name, acc.pop(name)
+
+                end, in_fun, name = outer
+
+            if capture == "identifier":
+                if in_fun and start != skipped:
+                    acc[name].append(text(node))
+            elif capture == "function":
+                stack.append((end, in_fun, name))
+                in_fun, name = self.visit(node, node.parent, acc, ids, in_fun, name)
+                end = node.end_byte
+            elif capture == "skip":
+                skipped = start
+
+        while stack:
+            outer = stack.pop()
+
+            if name in acc and starts_function((in_fun, name), outer[1:]):
+                yield name, acc.pop(name)
+
+            end, in_fun, name = outer
+
+        yield from acc.items()
+
+
+query_clojure = QueryExtractor(
+    "clojure",
+    """
+    (list_lit) @function
+    (
+      [(sym_name) (sym_ns)] @identifier
+      (#not-match? @identifier "^(defn|defn-|def|defmacro|defmethod)$")
+    )
+    """,
+    extract_clojure,
+)
+
+query_haskell = QueryExtractor(
+    "haskell",
+    """
+    (function) @function
+    (variable) @identifier
+    """,
+    extract_haskell,
+)
+
+query_elixir = QueryExtractor(
+    "elixir",
+    """
+    (call) @function
+    ((identifier) @identifier (#not-match? @identifier "^(def|defp|defmacro)$"))
+    """,
+    extract_elixir,
+)
+
+query_erlang = QueryExtractor(
+    "erlang",
+    """
+    (fun_decl) @function
+    [(atom) (var)] @identifier
+    """,
+    extract_erlang,
+)
+
+query_python = QueryExtractor(
+    "python",
+    """
+    (function_definition) @function
+    (type (identifier) @skip)
+    (identifier) @identifier
+    """,
+    extract_python,
+)
+
+query_javascript = QueryExtractor(
+    "javascript",
+    """
+    [
+      (function)
+      (function_declaration)
+      (arrow_function)
+      (method_definition)
+      (generator_function_declaration)
+    ] @function
+    (identifier) @identifier
+    """,
+    extract_javascript,
+)
+
+query_c = QueryExtractor(
+    "c",
+    """
+    (function_definition) @function
+    (identifier) @identifier
+    """,
+    extract_c,
+)
+
+query_fortran = QueryExtractor(
+    "fortran",
+    """
+    [(function) (subroutine)] @function
+    (identifier) @identifier
+    """,
+    extract_fortran,
+)
+
+query_java = QueryExtractor(
+    "java",
+    """
+    (method_declaration) @function
+    (identifier) @identifier
+    """,
+    extract_java,
+)
+
+query_ocaml = QueryExtractor(
+    "ocaml",
+    """
+    (let_binding) @function
+    (value_name) @identifier
+    """,
+    extract_ocaml,
+)
@@ -0,0 +1,2 @@
+f(X) -> 'hllo', X.
+g(Y) -> Y.
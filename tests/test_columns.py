@@ -0,0 +1,25 @@
+import numpy as np
+
+from db.columns import column_array, select_functions
+
+
+def test_select_functions():
+    statement = str(select_functions(["id", "names"], repo_id=1, lang="c"))
+
+    assert statement.startswith("SELECT functions.id, functions.names")
+    assert "functions.repo_id = :repo_id_1 AND functions.lang = :lang_1" in statement
+    assert str(select_functions(["id"], term_entropy=None)).endswith(
+        "WHERE functions.term_entropy IS NULL"
+    )
+
+
+def test_column_array():
+    ids = column_array("id", [1, 2, 3])
+    orders = column_array("order", [1, None])
+    entropy = column_array("term_entropy", [0.5, None])
+    names = column_array("names", ["a b", "c"])
+
+    assert ids.dtype == np.int64 and ids.tolist() == [1, 2, 3]
+    assert orders.dtype == np.float64 and np.isnan(orders[1])
+    assert entropy.dtype == np.float64 and np.isnan(entropy[1])
+    assert names.dtype == object and names.tolist() == ["a b", "c"]
@@ -0,0 +1,24 @@
+from db.utils import copy_value, group_metrics
+
+
+def test_copy_value():
+    assert copy_value(None) == "\\N"
+    assert copy_value(12) == "12"
+    assert copy_value(False) == "False"
+    assert copy_value("a\tb\nc\\d\r") == "a\\tb\\nc\\\\d\\r"
+
+
+def test_group_metrics():
+    groups = group_metrics(
+        {
+            1: dict(term_entropy=0.5),
+            2: dict(median_id_length=4.0, term_entropy=None),
+            3: dict(term_entropy=1.5),
+            4: dict(term_entropy=2.0, median_id_length=3.0),
+        }
+    )
+
+    assert groups == {
+        ("term_entropy",): [(1, 0.5), (3, 1.5)],
+        ("median_id_length", "term_entropy"): [(2, 4.0, None), (4, 3.0, 2.0)],
+    }
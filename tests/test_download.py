@@ -0,0 +1,160 @@
+import os
+import subprocess
+from datetime import datetime, timezone
+
+from scripts.download import CloneTask, clone_all, get_first_commit_date_from_clone
+
+GIT = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+
+
+def make_remote(root, owner, name, files):
+    """
+    Create bare repository 'root/owner/name.git' containing 'files'.
+    """
+    src = os.path.join(root, "src", owner, name)
+    os.makedirs(src)
+
+    for path, content in files.items():
+        os.makedirs(os.path.join(src, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(src, path), "w") as f:
+            f.write(content)
+
+    subprocess.run(GIT + ["init", "-q", "-b", "main", src], check=True)
+    subprocess.run(GIT + ["-C", src, "add", "."], check=True)
+    subprocess.run(GIT + ["-C", src, "commit", "-q", "-m", "init"], check=True)
+
+    remote = os.path.join(root, "remotes", owner, f"{name}.git")
+    subprocess.run(GIT + ["clone", "-q", "--bare", src, remote], check=True)
+    subprocess.run(GIT + ["-C", remote, "config", "uploadpack.allowFilter", "true"])
+    return f"file://{remote}"
+
+
+def list_files(path):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, filename), path)
+        for dirpath, dirnames, filenames in os.walk(path)
+        if ".git" not in dirpath.split(os.sep)
+        for filename in filenames
+    )
+
+
+def test_clone_all(tmp_path):
+    files = {
+        "README.md": "# Project\n",
+        "src/main.py": "def main():\n    pass\n",
+        "src/lib/util.py": "x = 1\n",
+        "web/app.js": "function app() {}\n",
+        "native/ext.c": "int main() { return 0; }\n",
+    }
+    tasks = [
+        CloneTask(
+            i,
+            make_remote(tmp_path, "owner", f"repo{i}", files),
+            os.path.join(tmp_path, "data", lang, f"owner_repo{i}"),
+            lang,
+            "main",
+        )
+        for i, lang in enumerate(["python", "javascript", "c"])
+    ]
+
+    results = {result.repo_id: result for result in clone_all(tasks, workers=3)}
+
+    assert [results[i].error for i in range(3)] == [None, None, None]
+    assert list_files(tasks[0].path) == ["README.md", "src/lib/util.py", "src/main.py"]
+    assert list_files(tasks[1].path) == ["README.md", "web/app.js"]
+    assert list_files(tasks[2].path) == ["README.md", "native/ext.c"]
+    assert results[0].readme == "# Project\n"
+    assert results[0].fetched > 0
+
+    # Blobs of files outside of sparse checkout are never downloaded
+    missing = subprocess.run(
+        [
+            "git",
+            "-C",
+            tasks[0].path,
+            "rev-list",
+            "--objects",
+            "--missing=print",
+            "HEAD",
+        ],
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert len([line for line in missing.splitlines() if line.startswith("?")]) == 2
+
+
+def test_clone_all_reports_errors(tmp_path):
+    task = CloneTask(
+        1, f"file://{tmp_path}/missing.git", os.path.join(tmp_path, "dst"), "c", None
+    )
+
+    results = list(clone_all([task]))
+
+    assert len(results) == 1
+    assert results[0].error
+    assert not os.path.exists(task.path)
+
+
+def test_get_first_commit_date_from_clone(tmp_path):
+    make_remote(tmp_path, "owner", "repo", {"README.md": "# Project\n"})
+    src = os.path.join(tmp_path, "src", "owner", "repo")
+    env = dict(os.environ, GIT_COMMITTER_DATE="2020-06-01T12:00:00+02:00")
+    subprocess.run(
+        GIT + ["-C", src, "commit", "-q", "--allow-empty", "-m", "second"], env=env
+    )
+    full = os.path.join(tmp_path, "full")
+    shallow = os.path.join(tmp_path, "shallow")
+    subprocess.run(GIT + ["clone", "-q", src, full], check=True)
+    subprocess.run(GIT + ["-C", src, "config", "uploadpack.allowFilter", "true"])
+    clone = ["clone", "-q", "--depth", "1", "--filter=blob:none"]
+    subprocess.run(GIT + clone + [f"file://{src}", shallow], check=True)
+    subprocess.run(
+        GIT + ["-C", full, "commit", "-q", "--allow-empty", "-m", "third"], env=env
+    )
+    root = subprocess.run(
+        ["git", "-C", full, "log", "--format=%ct", "--reverse"],
+        capture_output=True,
+        text=True,
+    ).stdout.split()[0]
+
+    root = datetime.fromtimestamp(int(root), timezone.utc).replace(tzinfo=None)
+
+    assert get_first_commit_date_from_clone(full) == root
+    assert get_first_commit_date_from_clone(shallow) == root
+    assert get_first_commit_date_from_clone(os.path.join(tmp_path, "none")) is None
+
+
+def test_clone_all_bare(tmp_path):
+    files = {
+        "README.md": "# Project\n",
+        "src/main.py": "def main():\n    pass\n",
+        "web/app.js": "function app() {}\n",
+    }
+    task = CloneTask(
+        1,
+        make_remote(tmp_path, "owner", "repo", files),
+        os.path.join(tmp_path, "data", "python", "owner_repo"),
+        "python",
+        None,
+        True,
+    )
+
+    result = next(clone_all([task]))
+
+    assert result.error is None
+    assert result.readme == "# Project\n"
+    assert not os.path.exists(os.path.join(task.path, "src"))
+    missing = subprocess.run(
+        ["git", "-C", task.path, "rev-list", "--objects", "--missing=print", "HEAD"],
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert [line for line in missing.splitlines() if line.startswith("?")] == [
+        "?" + hash_object(files["web/app.js"])
+    ]
+
+
+def hash_object(content):
+    return subprocess.run(
+        ["git", "hash-object", "--stdin"], input=content, capture_output=True, text=True
+    ).stdout.strip()
@@ -0,0 +1,116 @@
+import multiprocessing
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from scripts.extract import functions
+from scripts.extract.functions import in_batch, plan_tasks, run_tasks, wait_for_task
+from scripts.extract.writer import WriterClient
+
+
+def make_repo(id, size):
+    return SimpleNamespace(id=id, name=f"repo{id}", path=f"data/repo{id}", size=size)
+
+
+def test_plan_tasks_largest_first(monkeypatch):
+    monkeypatch.setattr(functions, "BATCH_SIZE_KB", 1000)
+    repos = [
+        (make_repo(1, 10), "c"),
+        (make_repo(2, None), "python"),
+        (make_repo(3, 2500), "c"),
+        (make_repo(4, 900), "java"),
+        (make_repo(5, 100000), "c"),
+    ]
+
+    tasks = plan_tasks(repos, processes=4, engine="query")
+
+    assert [(repo[0], batch) for repo, _, _, _, _, batch in tasks] == [
+        (5, (0, 4)),
+        (5, (1, 4)),
+        (5, (2, 4)),
+        (5, (3, 4)),
+        (4, (0, 1)),
+        (3, (0, 3)),
+        (3, (1, 3)),
+        (3, (2, 3)),
+        (1, (0, 1)),
+        (2, (0, 1)),
+    ]
+    assert tasks[4] == (
+        (4, "repo4", "data/repo4"),
+        "java",
+        "files",
+        "query",
+        False,
+        (0, 1),
+    )
+
+
+def test_batches_partition_files():
+    paths = [f"data/repo/src/file{i}.c" for i in range(1000)]
+    batches = [[p for p in paths if in_batch(p, (i, 3))] for i in range(3)]
+
+    assert sorted(sum(batches, [])) == sorted(paths)
+    assert all(batch for batch in batches)
+    assert all(in_batch(p, (0, 1)) for p in paths)
+
+
+class PendingTask:
+    def __init__(self, polls):
+        self.polls = polls
+
+    def get(self, timeout):
+        self.polls -= 1
+
+        if self.polls > 0:
+            raise multiprocessing.TimeoutError()
+
+        return "result"
+
+
+def test_wait_for_task_checks_writer(monkeypatch):
+    monkeypatch.setattr(functions, "WRITER_CHECK_INTERVAL", 0)
+    alive = SimpleNamespace(is_alive=lambda: True, exitcode=None)
+    dead = SimpleNamespace(is_alive=lambda: False, exitcode=1)
+
+    assert wait_for_task(PendingTask(3), alive) == "result"
+
+    with pytest.raises(RuntimeError, match="code 1"):
+        wait_for_task(PendingTask(3), dead)
+
+
+def send_messages(task, count, size):
+    writer = WriterClient(functions.writer_queue)
+
+    for i in range(count):
+        writer.send("file", task, i, b"x" * size)
+
+    writer.close()
+    return [[task], [], None, {}]
+
+
+def slow_writer(queue, received):
+    count = 0
+
+    while queue.get() is not None:
+        time.sleep(0.001)
+        count += 1
+
+    received.put(count)
+
+
+def test_run_tasks_delivers_queued_messages():
+    queue = multiprocessing.Queue(4)
+    received = multiprocessing.Queue()
+    writer = multiprocessing.Process(target=slow_writer, args=(queue, received))
+    writer.start()
+    tasks = [(task, 50, 100000) for task in range(8)]
+
+    results = list(run_tasks(send_messages, tasks, 4, queue, writer))
+    queue.put(None)
+    writer.join(timeout=30)
+
+    assert [successes for successes, _, _, _ in results] == [[i] for i in range(8)]
+    assert not writer.is_alive()
+    assert received.get(timeout=1) == 8 * 50
@@ -0,0 +1,308 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+
+from scripts.download import (
+    RepoMetadata,
+    get_all_repos_metadata,
+    get_first_commit_date_from_api,
+)
+from scripts.github import GithubClient, ResponseCache
+
+
+class StubGithub(BaseHTTPRequestHandler):
+    """
+    Emulates Github's primary rate limit: 'limit' requests per 'window'
+    seconds, after which requests are rejected with 403 until reset.
+    Requests to '/retry-after' are rejected once with 429 and 'Retry-After'.
+    """
+
+    limit = 3
+    window = 1
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+
+        with self.lock:
+            now = time.time()
+
+            if now >= server.reset:
+                server.reset = now + self.window
+                server.remaining = self.limit
+
+            if self.path == "/retry-after" and not server.retried:
+                server.retried = True
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.end_headers()
+                return
+
+            if server.remaining == 0:
+                server.rejected += 1
+                status = 403
+            else:
+                server.remaining -= 1
+                status = 200
+
+            self.send_response(status)
+            self.send_header("X-RateLimit-Limit", str(self.limit))
+            self.send_header("X-RateLimit-Remaining", str(server.remaining))
+            self.send_header("X-RateLimit-Reset", str(int(server.reset)))
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"path": self.path}).encode())
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGithub)
+    server.reset, server.remaining = 0, 0
+    server.rejected, server.retried = 0, False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+async def fetch(base_url, paths):
+    async with GithubClient(token="token", base_url=base_url) as client:
+        first = await client.get(paths[0])
+        rest = await asyncio.gather(*[client.get(path) for path in paths[1:]])
+        return [first] + rest
+
+
+def test_waits_for_rate_limit_reset():
+    server, url = start_server()
+
+    try:
+        responses = asyncio.run(fetch(url, [f"/repos/{i}" for i in range(7)]))
+    finally:
+        server.shutdown()
+
+    assert [r.status_code for r in responses] == [200] * 7
+    assert [r.json()["path"] for r in responses] == [f"/repos/{i}" for i in range(7)]
+    assert server.rejected == 0
+
+
+def test_retries_after_retry_after():
+    server, url = start_server()
+    start = time.time()
+
+    try:
+        responses = asyncio.run(fetch(url, ["/retry-after"]))
+    finally:
+        server.shutdown()
+
+    assert responses[0].status_code == 200
+    assert time.time() - start >= 1
+
+
+class StubGraphQL(BaseHTTPRequestHandler):
+    """
+    Resolves aliased 'repository' lookups built by 'build_metadata_query'.
+    Repositories named 'missing' are not found.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        variables = body["variables"]
+        self.server.queries.append(body)
+        data = {}
+
+        for i in range(len(variables) // 2):
+            owner, name = variables[f"o{i}"], variables[f"n{i}"]
+            data[f"r{i}"] = None
+
+            if name != "missing":
+                data[f"r{i}"] = {
+                    "defaultBranchRef": {"name": f"{owner}-branch"},
+                    "diskUsage": i,
+                    "stargazerCount": 10 * i,
+                    "pushedAt": "2024-09-01T12:00:00Z",
+                }
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({"data": data}).encode())
+
+
+def test_get_all_repos_metadata(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGraphQL)
+    server.queries = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    repos = [
+        SimpleNamespace(id=i, owner=f"owner{i}", name="missing" if i == 7 else "repo")
+        for i in range(150)
+    ]
+
+    try:
+        os.environ["GITHUB_API_URL"] = f"http://127.0.0.1:{server.server_port}"
+        os.environ["GITHUB_CACHE_PATH"] = str(tmp_path / "cache.sqlite")
+        metadata = asyncio.run(get_all_repos_metadata(repos))
+        cached = asyncio.run(get_all_repos_metadata(repos))
+    finally:
+        del os.environ["GITHUB_API_URL"]
+        del os.environ["GITHUB_CACHE_PATH"]
+        server.shutdown()
+
+    assert len(server.queries) == 2  # second run is replayed from cache
+    assert cached == metadata
+    assert sorted(len(q["variables"]) for q in server.queries) == [100, 200]
+    assert len(metadata) == 149
+    assert 7 not in metadata
+    assert metadata[120] == RepoMetadata(
+        "owner120-branch",
+        20,
+        200,
+        datetime(2024, 9, 1, 12),
+    )
+
+
+class StubETag(BaseHTTPRequestHandler):
+    """
+    Serves JSON documents with ETag and answers matching conditional
+    requests with 304.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        etag = f'"{self.path}"'
+        self.server.requests.append(self.headers.get("If-None-Match"))
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = json.dumps({"path": self.path, "padding": "x" * 1000}).encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+async def fetch_cached(url, paths, cache):
+    async with GithubClient(base_url=url, cache=cache) as client:
+        return [await client.get(path, params={"page": 1}) for path in paths]
+
+
+def test_response_cache(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubETag)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    path = str(tmp_path / "cache.sqlite")
+
+    try:
+        first = asyncio.run(fetch_cached(url, ["/a"], ResponseCache(path)))
+        fresh = asyncio.run(fetch_cached(url, ["/a"], ResponseCache(path)))
+        assert server.requests == [None]
+
+        stale = asyncio.run(fetch_cached(url, ["/a"], ResponseCache(path, ttl=0)))
+        assert server.requests == [None, '"/a?page=1"']
+    finally:
+        server.shutdown()
+
+    assert first[0].json()["path"] == "/a?page=1"
+    assert fresh[0].json() == first[0].json()
+    assert stale[0].status_code == 200
+    assert stale[0].json() == first[0].json()
+
+
+def test_response_cache_eviction(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubETag)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_mb=3000 / 2**20)
+
+    try:
+        asyncio.run(fetch_cached(url, ["/a", "/b", "/c", "/d"], cache))
+    finally:
+        server.shutdown()
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    keys = [
+        cache.key("GET", f"{url}{path}", {"page": 1}) for path in "/a /b /c /d".split()
+    ]
+
+    assert cache.size <= 3000
+    assert [cache.get(key) is not None for key in keys] == [False, False, True, True]
+
+
+class StubCommits(BaseHTTPRequestHandler):
+    """
+    Lists 'total' commits of repository 'owner/name' one per page, newest
+    first, with pagination 'Link' header. Other repositories are not found.
+    """
+
+    total = 5000
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = httpx.URL(self.path)
+        self.server.requests.append(self.path)
+
+        if url.path != "/repos/owner/name/commits":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        page = int(url.params.get("page", 1))
+        date = f"2010-01-01T00:00:{self.total - page:02d}Z"
+        base = f"http://127.0.0.1:{self.server.server_port}{url.path}"
+        body = json.dumps([{"commit": {"committer": {"date": date}}}]).encode()
+        self.send_response(200)
+        self.send_header(
+            "Link",
+            f'<{base}?per_page=1&page={page + 1}>; rel="next", '
+            f'<{base}?per_page=1&page={self.total}>; rel="last"',
+        )
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_get_first_commit_date_from_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCommits)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    repos = [
+        SimpleNamespace(owner="owner", name="name"),
+        SimpleNamespace(owner="owner", name="missing"),
+    ]
+
+    async def fetch():
+        async with GithubClient(base_url=url) as client:
+            return [await get_first_commit_date_from_api(client, r) for r in repos]
+
+    try:
+        dates = asyncio.run(fetch())
+    finally:
+        server.shutdown()
+
+    assert dates == [datetime(2010, 1, 1), None]
+    assert server.requests[:2] == [
+        "/repos/owner/name/commits?per_page=1",
+        "/repos/owner/name/commits?per_page=1&page=5000",
+    ]
@@ -0,0 +1,14 @@
+from db.migrations import MIGRATIONS
+
+
+def test_versions_increase():
+    versions = [version for version, _, _ in MIGRATIONS]
+
+    assert versions == sorted(set(versions))
+
+
+def test_statements_are_idempotent():
+    for _, _, statements in MIGRATIONS:
+        for statement in statements:
+            if statement.startswith(("ALTER", "CREATE")):
+                assert "IF NOT EXISTS" in statement, statement
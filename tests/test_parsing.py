@@ -1,11 +1,17 @@
+import pytest
 from scripts.parsing.parsers import *
 from tree_sitter import Language, Parser
 
+ENGINES = ["walk", "query"]
 
-def test_clojure():
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_clojure(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "clojure"))
-    names = extract(parser, "tests/samples/clojure.clj", extract_clojure)
+    names = extract(
+        parser, "tests/samples/clojure.clj", get_extractor("clojure", engine)
+    )
 
     assert names["add#1"] == ["add", "a", "b", "+", "a", "b"]
     assert names["add#2"] == ["add", "fn", "a", "b", "+", "a", "b"]
@@ -23,10 +29,13 @@ def test_clojure():
     ]
 
 
-def test_haskell():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_haskell(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "haskell"))
-    names = extract(parser, "tests/samples/haskell.hs", extract_haskell)
+    names = extract(
+        parser, "tests/samples/haskell.hs", get_extractor("haskell", engine)
+    )
 
     assert names == {
         "add#1": ["add", "y", "y"],
@@ -69,10 +78,11 @@ def test_haskell():
     }
 
 
-def test_elixir():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_elixir(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "elixir"))
-    names = extract(parser, "tests/samples/elixir.ex", extract_elixir)
+    names = extract(parser, "tests/samples/elixir.ex", get_extractor("elixir", engine))
 
     assert names == {
         "foo#1": ["foo", "arg1", "arg2", "arg1", "arg2"],
@@ -84,10 +94,11 @@ def test_elixir():
     }
 
 
-def test_erlang():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_erlang(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "erlang"))
-    names = extract(parser, "tests/samples/erlang.erl", extract_erlang)
+    names = extract(parser, "tests/samples/erlang.erl", get_extractor("erlang", engine))
     assert names == {
         "public_function#1": ["public_function", "Arg", "private_function", "Arg"],
         "private_function#2": ["private_function", "Arg"],
@@ -142,10 +153,23 @@ def test_erlang():
     }
 
 
-def test_c():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_non_utf8(engine):
+    parser = Parser()
+    parser.set_language(Language("build/parser_bindings.so", "erlang"))
+    extract_fn = get_extractor("erlang", engine)
+    names = extract(parser, "tests/samples/erlang_latin1.erl", extract_fn)
+    assert names == {
+        "f#1": ["f", "X", "'h\ufffdllo'", "X"],
+        "g#2": ["g", "Y", "Y"],
+    }
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_c(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "c"))
-    names = extract(parser, "tests/samples/c.c", extract_c)
+    names = extract(parser, "tests/samples/c.c", get_extractor("c", engine))
 
     assert names == {
         "add": ["add", "a", "b", "a", "b"],
@@ -197,10 +221,13 @@ def test_c():
     }
 
 
-def test_javascript():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_javascript(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "javascript"))
-    names = extract(parser, "tests/samples/javascript.js", extract_javascript)
+    names = extract(
+        parser, "tests/samples/javascript.js", get_extractor("javascript", engine)
+    )
 
     assert names == {
         "generateSequence#1": [
@@ -218,10 +245,11 @@ def test_javascript():
     }
 
 
-def test_python():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_python(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "python"))
-    names = extract(parser, "tests/samples/python.py", extract_python)
+    names = extract(parser, "tests/samples/python.py", get_extractor("python", engine))
 
     assert names == {
         "add#1": ["add", "x", "y", "x", "y"],
@@ -271,10 +299,11 @@ def test_python():
     }
 
 
-def test_java():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_java(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "java"))
-    names = extract(parser, "tests/samples/java.java", extract_java)
+    names = extract(parser, "tests/samples/java.java", get_extractor("java", engine))
 
     assert names == {
         "add#1": ["add", "x", "y", "x", "y"],
@@ -308,10 +337,13 @@ def test_java():
     }
 
 
-def test_fortran():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_fortran(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "fortran"))
-    names = extract(parser, "tests/samples/fortran.f90", extract_fortran)
+    names = extract(
+        parser, "tests/samples/fortran.f90", get_extractor("fortran", engine)
+    )
 
     assert names == {
         "add#1": ["add", "x", "y", "sum", "x", "y", "sum", "sum", "x", "y"],
@@ -344,10 +376,11 @@ def test_fortran():
     }
 
 
-def test_ocaml():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ocaml(engine):
     parser = Parser()
     parser.set_language(Language("build/parser_bindings.so", "ocaml"))
-    names = extract(parser, "tests/samples/ocaml.ml", extract_ocaml)
+    names = extract(parser, "tests/samples/ocaml.ml", get_extractor("ocaml", engine))
     assert names == {
         "add": ["add", "x", "y"],
         "subtract": ["subtract", "neg", "y", "x", "neg", "y"],
@@ -365,3 +398,49 @@ def test_ocaml():
         "pow": ["pow", "exp", "base", "pow", "exp"],
         "gcd": ["gcd", "a", "b", "gcd", "b", "a", "a"],
     }
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_c_declarators(engine):
+    parser = Parser()
+    parser.set_language(Language("build/parser_bindings.so", "c"))
+    source = b"""
+    static int *pointer(int a) { return a; }
+    int (*callback(int a))(char) { return a; }
+    DEFINE_HANDLER(macro) { int prototype(int b); }
+    """
+    names = extract_content(parser, source, get_extractor("c", engine))
+
+    assert names == {
+        "pointer": ["pointer", "a", "a"],
+        "(*callback(int a))": ["callback", "a", "a"],
+    }
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_stream(engine):
+    parser = Parser()
+    parser.set_language(Language("build/parser_bindings.so", "python"))
+    content = load_file("tests/samples/python.py")
+    records = list(stream(parser, content, get_extractor("python", engine), "f.py"))
+
+    assert [r.order for r in records] == list(range(1, 14))
+    assert {r.file for r in records} == {"f.py"}
+    # Nested 'wrapper' is complete before enclosing 'decorator'
+    assert [r.name for r in records[10:12]] == ["wrapper#12", "decorator#11"]
+    assert {r.name: r.identifiers for r in records} == extract_content(
+        parser, content, get_extractor("python", engine)
+    )
+
+
+def test_stream_timeout():
+    parser = Parser()
+    parser.set_language(Language("build/parser_bindings.so", "c"))
+    nested = b"int f(int x) { return " + b"(" * 100000 + b"x" + b")" * 100000 + b"; }"
+
+    with pytest.raises(ParseTimeout):
+        list(stream(parser, nested, extract_c, "f.c", timeout=0.001))
+
+    # Parser is usable again after a stopped parse
+    records = list(stream(parser, b"int g(int y) { return y; }", extract_c, timeout=5))
+    assert [(r.name, r.identifiers) for r in records] == [("g", ["g", "y", "y"])]
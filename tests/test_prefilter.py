@@ -0,0 +1,67 @@
+import os
+
+from scripts.extract.prefilter import (
+    MAX_FILE_SIZE,
+    Prefilter,
+    content_skip_reason,
+    path_skip_reason,
+)
+from scripts.extract.sources import SourceFile
+
+SAMPLES_DIR = "tests/samples"
+
+
+def test_path_skip_reason():
+    assert path_skip_reason("src/main.js") is None
+    assert path_skip_reason("web/node_modules/react/index.js") == "vendored"
+    assert path_skip_reason("Third_Party/zlib/inflate.c") == "vendored"
+    assert path_skip_reason("src/vendor.js") is None
+    assert path_skip_reason("static/app.min.js") == "generated"
+    assert path_skip_reason("proto/service_pb2.py") == "generated"
+    assert path_skip_reason("sqlite3.c", MAX_FILE_SIZE + 1) == "oversized"
+
+
+def test_content_skip_reason():
+    function = b"def f(a, b):\n    return a + b\n\n"
+    minified = b"function f(a,b){return a+b};" * 200
+    dense = b"\n".join([b"x=[" + b",".join([b"1"] * 200) + b"];"] * 20)
+
+    assert content_skip_reason(function * 500) is None
+    assert content_skip_reason(b"# @generated by protoc\n" + function) == "generated"
+    assert content_skip_reason(b"/* Code generated by yacc. DO NOT EDIT. */\n") == (
+        "generated"
+    )
+    assert content_skip_reason(function * 10 + b"# do not edit\n") is None
+    assert content_skip_reason(minified) == "minified"
+    assert content_skip_reason(dense) == "minified"
+    assert content_skip_reason(function * 40000) == "oversized"
+
+
+def test_samples_are_not_skipped():
+    for file in os.listdir(SAMPLES_DIR):
+        path = os.path.join(SAMPLES_DIR, file)
+
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                assert content_skip_reason(f.read()) is None, file
+
+
+def test_prefilter_counts_reasons():
+    prefilter = Prefilter("data/repo")
+    files = [
+        SourceFile("data/repo/node_modules/a.js", 100, None),
+        SourceFile("data/repo/lib/a.min.js", 50, None),
+        SourceFile("data/repo/lib/b.min.js", 70, None),
+        SourceFile("data/repo/lib/main.js", 10, None),
+    ]
+
+    assert [prefilter.skip_path(f) for f in files] == [
+        "vendored",
+        "generated",
+        "generated",
+        None,
+    ]
+    assert prefilter.skip_content(b"var a=1;" * 1000) == "minified"
+    assert prefilter.files == dict(vendored=1, generated=2, minified=1)
+    assert prefilter.bytes == dict(vendored=100, generated=120, minified=8000)
+    assert prefilter.summary(0.001).endswith("about 8.2s saved")
@@ -0,0 +1,52 @@
+from scripts.extract.sampling import estimate_functions, sample_files
+from scripts.extract.sources import SourceFile
+
+
+def make_files(num_files):
+    return [SourceFile(f"repo/src/file_{i}.py", 0, None) for i in range(num_files)]
+
+
+def test_estimate_functions():
+    content = b"def f(a):\n    def g():\n        pass\n\nasync def h():\n    pass\n"
+
+    assert estimate_functions("python", content) == 3
+    assert estimate_functions("python", b"x = 'def'\n") == 0
+    assert estimate_functions("python", b"def test_f():\n    pass\n") == 0
+    assert estimate_functions("unknown", b"x" * 2500) == 2
+
+
+def test_sample_files_up_to_cap():
+    files = make_files(1000)
+    paths, num_files, total = sample_files(files, lambda f: 10, 500, seed=1)
+
+    assert (num_files, total) == (1000, 10000)
+    assert len(paths) == 50
+    assert paths <= {f.path for f in files}
+
+
+def test_sample_files_is_stable():
+    files = make_files(1000)
+    paths, _, _ = sample_files(files, lambda f: 1, 100, seed=1, root="repo")
+    reversed_paths, _, _ = sample_files(files[::-1], lambda f: 1, 100, 1, "repo")
+    moved = [SourceFile(f"data/{f.path}", 0, None) for f in files]
+    moved_paths, _, _ = sample_files(moved, lambda f: 1, 100, seed=1, root="data/repo")
+    other_paths, _, _ = sample_files(files, lambda f: 1, 100, seed=2, root="repo")
+
+    assert paths == reversed_paths
+    assert {f"data/{path}" for path in paths} == moved_paths
+    assert paths != other_paths
+
+
+def test_sample_files_is_uniform():
+    files = make_files(1000)
+    paths, _, _ = sample_files(files, lambda f: 1, 200, seed=1)
+    indices = [int(path.split("_")[-1][:-3]) for path in paths]
+
+    assert 60 < sum(index < 500 for index in indices) < 140
+
+
+def test_sample_files_all_below_cap():
+    files = make_files(10)
+    paths, _, _ = sample_files(files, lambda f: 5, 100, seed=1)
+
+    assert paths == {f.path for f in files}
@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+
+from tree_sitter import Language, Parser
+
+from scripts.extract.sources import (
+    archive_files,
+    disk_files,
+    git_files,
+    hash_content,
+    prefetch,
+    tracked_files,
+)
+from scripts.parsing.parsers import extract_content, extract_python
+
+GIT = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+
+
+def make_repo(path):
+    os.makedirs(os.path.join(path, "pkg"))
+    shutil.copy("tests/samples/python.py", os.path.join(path, "pkg", "sample.py"))
+    shutil.copy("tests/samples/java.java", os.path.join(path, "Sample.java"))
+
+    with open(os.path.join(path, "readme.py"), "w") as f:
+        f.write("def skipped():\n    pass\n")
+
+    subprocess.run(GIT + ["init", "-q", path], check=True)
+    subprocess.run(GIT + ["-C", path, "add", "."], check=True)
+    subprocess.run(GIT + ["-C", path, "commit", "-q", "-m", "init"], check=True)
+
+
+def extract_all(files):
+    parser = Parser()
+    parser.set_language(Language("build/parser_bindings.so", "python"))
+    return {
+        file.path: extract_content(parser, file.load(), extract_python)
+        for file in files
+    }
+
+
+def test_git_files(tmp_path):
+    repo = os.path.join(tmp_path, "repo")
+    bare = os.path.join(tmp_path, "bare")
+    make_repo(repo)
+    subprocess.run(GIT + ["clone", "-q", "--bare", repo, bare], check=True)
+
+    from_disk = extract_all(disk_files(repo, "python"))
+    from_git = extract_all(git_files(bare, "python"))
+
+    assert list(from_disk) == [os.path.join(repo, "pkg", "sample.py")]
+    assert list(from_git) == [os.path.join(bare, "pkg", "sample.py")]
+    assert list(from_git.values()) == list(from_disk.values())
+
+
+def test_archive_files(tmp_path):
+    repo = os.path.join(tmp_path, "repo")
+    make_repo(repo)
+    from_disk = extract_all(disk_files(repo, "python"))
+
+    for fmt in ["gztar", "zip"]:
+        archive = shutil.make_archive(os.path.join(tmp_path, "repo"), fmt, repo)
+        from_archive = extract_all(archive_files(archive, "python"))
+
+        assert list(from_archive) == [os.path.join(archive, "pkg", "sample.py")]
+        assert list(from_archive.values()) == list(from_disk.values())
+
+
+def test_hash_content_matches_git(tmp_path):
+    repo = os.path.join(tmp_path, "repo")
+    make_repo(repo)
+
+    from_disk = {f.path: hash_content(f.load()) for f in disk_files(repo, "python")}
+    from_git = {f.path: f.hash for f in git_files(repo, "python")}
+
+    assert from_git == from_disk
+
+
+def test_prefetch_tar_stream(tmp_path):
+    repo = os.path.join(tmp_path, "repo")
+    make_repo(repo)
+
+    for i in range(5):
+        shutil.copy("tests/samples/python.py", os.path.join(repo, f"copy{i}.py"))
+
+    archive = shutil.make_archive(os.path.join(tmp_path, "repo"), "gztar", repo)
+    skip = lambda f: f.path.endswith("copy0.py")
+    loaded = {
+        f.path: f.load()
+        for f in prefetch(archive_files(archive, "python"), skip)
+        if not skip(f)
+    }
+
+    with open("tests/samples/python.py", "rb") as f:
+        content = f.read()
+
+    assert len(loaded) == 5
+    assert set(loaded.values()) == {content}
+
+
+def test_pruned_and_tracked_files(tmp_path):
+    repo = os.path.join(tmp_path, "repo")
+    make_repo(repo)
+    os.makedirs(os.path.join(repo, "node_modules", "dep"))
+    shutil.copy("tests/samples/python.py", os.path.join(repo, "untracked.py"))
+    shutil.copy(
+        "tests/samples/python.py", os.path.join(repo, "node_modules", "dep", "x.py")
+    )
+    os.mkdir(os.path.join(repo, "link.py"))  # Directory with matching name
+
+    from_disk = sorted(f.path for f in disk_files(repo, "python"))
+    tracked = sorted(f.path for f in tracked_files(repo, "python"))
+
+    assert from_disk == [
+        os.path.join(repo, "pkg", "sample.py"),
+        os.path.join(repo, "untracked.py"),
+    ]
+    assert tracked == [os.path.join(repo, "pkg", "sample.py")]
+    assert sorted(f.path for f in tracked_files(tmp_path, "java")) == [
+        os.path.join(repo, "Sample.java")
+    ]